@@ -0,0 +1,133 @@
+import json
+
+
+class ActionExtractor:
+    """
+    Pull complete objects out of the "actions" array while the JSON is still arriving.
+
+    feed() takes the next chunk of model output and returns the actions whose
+    closing brace arrived in it. Markdown fences and chatter before the JSON
+    are skipped, and a bare top-level array is treated as the actions array.
+    Anything after the JSON document closes is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._skip_line = False
+
+    @property
+    def finished(self) -> bool:
+        """True once the top-level JSON value has closed"""
+        return self._finished
+
+    def _open(self, kind: str, index: int):
+        parent = self._stack[-1] if self._stack else None
+        is_actions = kind == "arr" and (
+            parent is None
+            or (len(self._stack) == 1 and parent["kind"] == "obj" and parent["key"] == "actions")
+        )
+        if parent is not None and parent["kind"] == "arr" and parent["actions"] and kind == "obj":
+            parent["item_start"] = index
+        self._stack.append({"kind": kind, "key": None, "expect_key": kind == "obj",
+                            "actions": is_actions, "item_start": None})
+
+    def _close(self, index: int, found: list):
+        self._stack.pop()
+        if not self._stack:
+            self._finished = True
+            return
+        parent = self._stack[-1]
+        if parent["kind"] == "arr" and parent["actions"] and parent["item_start"] is not None:
+            try:
+                item = json.loads(self._buffer[parent["item_start"]:index + 1])
+                if isinstance(item, dict):
+                    found.append(item)
+            except json.JSONDecodeError:
+                pass
+            parent["item_start"] = None
+
+    def _scan_preamble(self, i: int) -> int:
+        """Skip chatter and ``` fences up to the first { or [; returns the new index"""
+        buffer = self._buffer
+        while i < len(buffer):
+            if self._skip_line:
+                # The fence's language tag ends at the newline (or where the JSON starts)
+                if buffer[i] in "{[":
+                    self._skip_line = False
+                    continue
+                if buffer[i] == "\n":
+                    self._skip_line = False
+                i += 1
+                continue
+            if buffer.startswith("```", i):
+                if len(buffer) - i < 4:
+                    return i
+                self._skip_line = True
+                i += 3
+                continue
+            if buffer[i] in "{[":
+                self._started = True
+                return i
+            i += 1
+        return i
+
+    def feed(self, chunk: str) -> list:
+        self._buffer += chunk
+        found = []
+        if self._finished:
+            return found
+
+        buffer = self._buffer
+        i = self._pos
+        if not self._started:
+            i = self._scan_preamble(i)
+            if not self._started:
+                self._pos = i
+                return found
+
+        while i < len(buffer):
+            char = buffer[i]
+            top = self._stack[-1] if self._stack else None
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if top and top["kind"] == "obj" and top["expect_key"]:
+                        try:
+                            top["key"] = json.loads(buffer[self._string_start:i + 1])
+                        except json.JSONDecodeError:
+                            top["key"] = None
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == "{":
+                self._open("obj", i)
+            elif char == "[":
+                self._open("arr", i)
+            elif char in "}]":
+                self._close(i, found)
+                if self._finished:
+                    i += 1
+                    break
+            elif char == ":" and top and top["kind"] == "obj":
+                top["expect_key"] = False
+            elif char == "," and top and top["kind"] == "obj":
+                top["expect_key"] = True
+            i += 1
+        self._pos = i
+        return found
+
+
+def extract_actions(text: str) -> list:
+    """Every complete action object in a full or truncated model response"""
+    return ActionExtractor().feed(text)
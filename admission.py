@@ -0,0 +1,115 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from tracing import span
+
+# Requests processed at once, requests allowed to wait, and how long they may wait (seconds)
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', '64'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '128'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '10'))
+
+# Recent wait times kept for the percentile metrics
+WAIT_WINDOW = 512
+
+
+class AdmissionController:
+    """
+    Bounded admission queue in front of the LLM pipeline.
+
+    Up to max_active requests run at once and up to max_queue wait for a
+    slot for at most max_wait seconds. Anything beyond that fails fast with
+    429 and a Retry-After computed from the observed service time.
+    """
+
+    def __init__(self, max_active: int = ADMISSION_MAX_ACTIVE,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_wait: float = ADMISSION_MAX_WAIT):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(max_active)
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._service_time = None
+        self._waits = deque(maxlen=WAIT_WINDOW)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free for a request joining the queue now"""
+        service_time = self._service_time or 1.0
+        return max(1, math.ceil(service_time * (self.waiting + 1) / self.max_active))
+
+    def _reject(self, reason: str):
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({reason}), retry later",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold one processing slot for the duration of the block"""
+        if self.active + self.waiting >= self.max_active + self.max_queue:
+            self.rejected_full += 1
+            self._reject("queue full")
+
+        start = time.monotonic()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            with span("admission_wait", queue_depth=self.waiting):
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            self._reject("queue wait exceeded")
+        finally:
+            self.waiting -= 1
+
+        started = time.monotonic()
+        self._waits.append(started - start)
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+            elapsed = time.monotonic() - started
+            # Smoothed service time drives Retry-After
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(q):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))], 4)
+
+        return {
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "peak_queue_depth": self.peak_waiting,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_wait_timeout": self.rejected_timeout,
+            "wait_seconds_p50": percentile(0.5),
+            "wait_seconds_p95": percentile(0.95),
+            "wait_seconds_max": round(waits[-1], 4) if waits else 0.0,
+            "service_seconds_avg": round(self._service_time or 0.0, 4),
+        }
+
+
+admission = AdmissionController()
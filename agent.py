@@ -1,115 +1,81 @@
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
+import copy
 import json
+import asyncio
 from fastapi import HTTPException
+from matcher import match_fields, needs_filling
+from prompt_prep import collect_fields, build_form_payload
+from option_pruning import prune_options, validate_option_actions
+from field_encoder import encode_form, encoding_report, FORMAT_NOTES, PROMPT_ENCODING
+from tokens import estimate_tokens, calibrated_tokens, token_calibration
+from uploads import strip_blobs, resolve_uploads
+from profile_projection import project_profile
+from profile_canonical import canonicalize_profile, with_aliases, profile_hash
+from fingerprint import structure_fingerprint
+from templates import form_templates
+from sharding import shard_fields, group_key
+from action_stream import ActionExtractor, extract_actions
+from json_repair import repair_json
+from hedging import llm_hedger
+from context_cache import context_caches, profile_prefix
+from prompt_budget import fit_prompt
+from metrics import timed, start_stage, count_fields, count_usage, count_error
+from tracing import span
 
 load_dotenv()
 
 # Configure Gemini
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemini-2.5-flash-lite')
+
+# Fast model for every request, stronger model re-asked only for doubtful fields ("" disables)
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-lite')
+ESCALATION_MODEL = os.getenv('ESCALATION_MODEL', 'gemini-2.5-flash')
+# Fast-model actions below this confidence are escalated, as are ones failing validation
+ESCALATION_CONFIDENCE = float(os.getenv('ESCALATION_CONFIDENCE', '0.8'))
+
+# Ask for JSON matching RESPONSE_SCHEMA instead of relying on prompt instructions
+STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', '1') != '0'
+
+# Upper bound on Gemini calls in flight per worker, the rest wait on the event loop
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '64'))
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
 SYSTEM_PROMPT = """You are a form autofill assistant. You receive:
 1. parsed_data: JSON with form fields (selectors, labels, types, options)
+   - Each field lists its "section" heading for context
    - Fields marked with "filled_by": "fuzzy_matching" are ALREADY FILLED - DO NOT TOUCH THEM
    - Only fill fields marked with "should_fill": true
 2. personal_details: User's stored information
+   - File uploads are handled by the server, never create upload_file actions
+   - "_aliases" lists other key names that held the same value as a key, e.g. {"phoneNumber": ["phone", "mobile"]}
 
 Your task:
 - Match personal_details to ONLY EMPTY form fields (should_fill: true)
 - SKIP any fields with "filled_by": "fuzzy_matching" 
-- Return actions in this exact format:
-{
-  "actions": [
-    {
-      "selector": "#field_id",
-      "action": "fill|check|uncheck|select|radio_select|select_multiple|fill_date|upload_file",
-      "value": "matched_value",
-      "confidence": 'Numeric value between 0-1 indicating match certainty (0.9+ = exact, 0.7-0.89 = high, 0.5-0.69 = medium, <0.5 = low)',
-      "reasoning": "Matched 'First Name' to firstName"
-    }
-  ],
-  "summary": {
-    "total_fields": 25,
-    "already_filled": 15,
-    "filled_by_ai": 8,
-    "skipped": 2
-  }
-}
+- Return one action per field you fill
 
 Action Types (USE APPROPRIATE TYPE):
-
 1. fill - Text inputs (text, email, tel, number, url, textarea)
-   {
-     "action": "fill",
-     "value": "John Doe"
-   }
-
-2. select - Single dropdown selection
-   {
-     "action": "select",
-     "value": "option_value_or_text"
-   }
-   IMPORTANT: For select fields, use the option VALUE from parsed_data.options.unselected array (first item in [value, text] pair)
-
-3. select_multiple - Multiple select dropdowns
-   {
-     "action": "select_multiple",
-     "value": ["value1", "value2", "value3"]
-   }
-   Use for <select multiple> fields (skills, languages, certifications)
-
-4. radio_select - Radio button groups
-   {
-     "action": "radio_select",
-     "value": "option_value"
-   }
-   Select one option from a radio group (gender, employment type, visa status)
-
-5. check - Single checkbox
-   {
-     "action": "check"
-   }
-   Use for: terms acceptance, single preferences, "yes/no" questions
-
-6. uncheck - Uncheck checkbox
-   {
-     "action": "uncheck"
-   }
-
-7. fill_date - Date inputs with proper formatting
-   {
-     "action": "fill_date",
-     "value": "2004-11-18"  # Use YYYY-MM-DD format for date inputs
-   }
-   Convert from personal_details date format to ISO format (YYYY-MM-DD)
-   Use date value from personal_details (DOB.day, DOB.month, DOB.year)
-
-8. upload_file - File upload fields
-   {
-     "action": "upload_file",
-     "value": "filename_from_personal_details.resume_filename"
-   }
-   Use for: resume, CV, cover letter, portfolio uploads
-   IMPORTANT: Check if personal_details contains 'resume_base64' and 'resume_filename'
-    Only create upload_file action if both exist and are not null
-
-9. spin_increment / spin_decrement - Number input adjustments
-   {
-     "action": "spin_increment"
-   }
-   Use for number inputs that need adjustment
+2. select - Single dropdown selection, value is the option VALUE (first item in the [value, text] pair)
+3. select_multiple - <select multiple> fields (skills, languages, certifications), option values go in "values"
+4. radio_select - One option of a radio group (gender, employment type, visa status), value is the option value
+5. check - Single checkbox: terms acceptance, single preferences, "yes/no" questions (no value)
+6. uncheck - Uncheck checkbox (no value)
+7. fill_date - Date inputs, value in YYYY-MM-DD converted from personal_details (DOB.day, DOB.month, DOB.year)
+8. spin_increment / spin_decrement - Number input adjustments (no value)
 
 CRITICAL RULES:
 1. CHECK "filled_by" field - if it equals "fuzzy_matching", DO NOT CREATE ACTION for that field
 2. ONLY process fields where "should_fill": true
-3. If value in a certain field is 'null' or 'string' do not use that to fill the field as its a error.
 3. NEVER alter selectors - use exact values from parsed_data.selector
 4. For SELECT fields: ALWAYS use option VALUE from parsed_data.options.unselected
+   Long option lists are cut to the best candidates; if none of them fit, use "__other__" as the value
 5. Handle nested personal_details (e.g., personal_details.DOB.month, personal_details.address.city)
 6. Use confidence scores: 0.95 (exact match), 0.9 (high confidence), 0.85 (good match), 0.7+ (acceptable)
 7. In summary, count fields by their status (already_filled, filled_by_ai, skipped)
+8. "source" is the personal_details path the value came from (e.g. "address.city"), leave it empty if the value was combined or reformatted
 
 MATCHING STRATEGY:
 - Name fields: firstName, lastName, middleName, fullName
@@ -121,10 +87,82 @@ MATCHING STRATEGY:
 - Handle multiple education/work entries by matching to corresponding form sections
 - For dropdowns: match personal_details values to option values in parsed_data.options
 - Gender: personal_details.gender → match to radio/select options
-- Multiple selections: split comma-separated or use arrays from personal_details
+- Multiple selections: split comma-separated or use arrays from personal_details"""
+
+# Only sent when STRUCTURED_OUTPUT is off and the model has no response schema to follow
+OUTPUT_FORMAT_PROMPT = """
+Return actions in this exact format:
+{
+  "actions": [
+    {
+      "selector": "#field_id",
+      "action": "fill",
+      "value": "matched_value",
+      "confidence": 0.95,
+      "reasoning": "Matched 'First Name' to firstName",
+      "source": "firstName"
+    }
+  ],
+  "summary": {"total_fields": 25, "already_filled": 15, "filled_by_ai": 8, "skipped": 2}
+}
 
 RETURN ONLY VALID JSON - NO MARKDOWN, NO EXPLANATIONS"""
 
+ACTION_TYPES = ["fill", "select", "select_multiple", "radio_select", "check", "uncheck",
+                "fill_date", "spin_increment", "spin_decrement"]
+
+# Declared output schema, replaces the JSON format instructions in the prompt
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "actions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "selector": {"type": "STRING"},
+                    "action": {"type": "STRING", "enum": ACTION_TYPES},
+                    "value": {"type": "STRING"},
+                    "values": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    "confidence": {"type": "NUMBER"},
+                    "reasoning": {"type": "STRING"},
+                    "source": {"type": "STRING"},
+                },
+                "required": ["selector", "action", "confidence"],
+            },
+        },
+        "summary": {
+            "type": "OBJECT",
+            "properties": {
+                "total_fields": {"type": "INTEGER"},
+                "already_filled": {"type": "INTEGER"},
+                "filled_by_ai": {"type": "INTEGER"},
+                "skipped": {"type": "INTEGER"},
+            },
+        },
+    },
+    "required": ["actions"],
+}
+
+# Prompt head actually sent with every request
+INSTRUCTIONS = SYSTEM_PROMPT if STRUCTURED_OUTPUT else SYSTEM_PROMPT + "\n" + OUTPUT_FORMAT_PROMPT
+
+
+def make_model(name: str, cached_content=None):
+    """Model with the output config; cached_content supplies the instructions + profile prefix"""
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": RESPONSE_SCHEMA,
+    } if STRUCTURED_OUTPUT else None
+    if cached_content is not None:
+        return genai.GenerativeModel.from_cached_content(cached_content=cached_content,
+                                                         generation_config=generation_config)
+    return genai.GenerativeModel(name, generation_config=generation_config)
+
+
+model = make_model(GEMINI_MODEL)
+escalation_model = make_model(ESCALATION_MODEL) if ESCALATION_MODEL and ESCALATION_MODEL != GEMINI_MODEL else None
+
 
 def sanitize_selector(selector: str) -> str:
     """Sanitize CSS selectors for edge cases"""
@@ -139,62 +177,509 @@ def sanitize_selector(selector: str) -> str:
     return selector
 
 
-def call_llm(parsed_data: dict, personal_details: dict) -> dict:
-    """Call Gemini to generate autofill actions"""
+def sanitize_actions(actions: list) -> list:
+    """Copies of the actions with sanitized selectors, for everything sent to the client"""
+    return [dict(act, selector=sanitize_selector(act.get("selector", ""))) for act in actions]
+
+
+def prepare_request(parsed_data: dict, personal_details: dict, profile: dict = None) -> dict:
+    """
+    Run every local stage before the LLM and build the prompt.
+
+    Returns a plan dict with the field counts, the actions already resolved
+    server-side, the fields left for the LLM and the prompt for them.
+    profile is a stored profile prepared by profile_store.prepare_profile,
+    whose blob stripping, canonicalization and serialization are reused.
+    """
+    # One deduplicated field list (sections + allFields), keyed by selector
+    all_fields = collect_fields(parsed_data)
     
     # Count fields by status for logging
-    all_fields = parsed_data.get('allFields', [])
     already_filled = sum(1 for f in all_fields if f.get('filled_by') == 'fuzzy_matching')
     should_fill = sum(1 for f in all_fields if f.get('should_fill') == True)
+
+    # Binary payloads (resume_base64, ...) never go into the prompt,
+    # file fields are completed server-side from the stored filename
+    if profile is None:
+        prompt_details, blob_paths = strip_blobs(personal_details)
+    else:
+        prompt_details, blob_paths = profile["prompt_details"], profile["blob_paths"]
+    upload_actions, remaining = resolve_uploads(all_fields, personal_details)
+
+    # Resolve boilerplate fields locally, only ambiguous ones go to Gemini
+    local_actions, remaining = match_fields(remaining, prompt_details)
+
+    # Reuse the selector -> profile path mapping learned on this form for earlier users
+    form_key = structure_fingerprint(parsed_data, all_fields)
+    template_actions, remaining = form_templates.materialize(form_key, remaining, prompt_details)
+    local_actions = upload_actions + local_actions + template_actions
     
     print(f"📊 Form Analysis:")
     print(f"   - Total fields: {len(all_fields)}")
     print(f"   - Already filled by fuzzy: {already_filled}")
     print(f"   - Need AI filling: {should_fill}")
-    
-    prompt = f"""
-{SYSTEM_PROMPT}
+    print(f"   - Matched locally: {len(local_actions)} ({len(template_actions)} from form template)")
+    if blob_paths:
+        print(f"   - Binary fields kept out of prompt: {', '.join(blob_paths)}")
+    count_fields(total=len(all_fields), already_filled=already_filled, should_fill=should_fill,
+                 matched_locally=len(local_actions))
+
+    plan = {
+        "all_fields": all_fields,
+        "already_filled": already_filled,
+        "should_fill": should_fill,
+        "local_actions": local_actions,
+        "template_actions": template_actions,
+        "remaining": remaining,
+        "form_key": form_key,
+        "prompt_details": prompt_details,
+        "prompts": [],
+        "shards": [],
+    }
+    if not any(needs_filling(f) for f in remaining):
+        return plan
+
+    # Collapse alias keys and placeholder junk (memoized per profile hash)
+    if profile is None:
+        canonical, aliases = canonicalize_profile(prompt_details)
+        fragment = None
+    else:
+        canonical, aliases, fragment = profile["canonical"], profile["aliases"], profile["fragment"]
+
+    # Long option lists only ship their best candidates, the full lists validate the answer
+    prompt_fields = prune_options(remaining, canonical)
+
+    # Large forms are split into shards that are generated concurrently
+    shards = shard_fields(prompt_fields, _field_tokens)
+    if len(shards) > 1:
+        print(f"   - Sharded into {len(shards)} LLM calls ({', '.join(str(len(s)) for s in shards)} fields)")
+    plan["shards"] = shards
+    # Kept to build the prompts, and to re-ask a truncated shard for its missing fields
+    plan["profile"] = profile
+    plan["parsed_data"] = parsed_data
+    plan["canonical"] = canonical
+    plan["aliases"] = aliases
+    plan["fragment"] = fragment
+    return plan
+
+
+def _field_tokens(field: dict) -> int:
+    return estimate_tokens(encode_form({"fields": [field]}, PROMPT_ENCODING))
+
+
+async def build_prompts(plan: dict):
+    """
+    Build each shard's prompt, behind the profile's provider-side cached prefix when it has one.
 
-FORM DATA:
-{json.dumps(parsed_data, indent=2)}
+    Stored profiles get their instructions + full profile cached per
+    profile version; their prompts are then only the form tail.
+    """
+    plan["llm"] = None
+    if plan["shards"] and plan["profile"] is not None:
+        with span("context_cache", profile_version=plan["profile"]["version"]):
+            cached = await context_caches.get(plan["profile"], GEMINI_MODEL, INSTRUCTIONS)
+        if cached is not None:
+            plan["llm"] = make_model(GEMINI_MODEL, cached)
+            print(f"   - Context cache: instructions + profile v{plan['profile']['version']} cached")
 
-PERSONAL DETAILS:
-{json.dumps(personal_details, indent=2)}
+    # Every prompt is checked against the token budget, trimmed or rejected before any call
+    prefix_tokens = calibrated_tokens(INSTRUCTIONS + profile_prefix(plan["fragment"])) if plan["llm"] else 0
+    plan["prompts"] = []
+    for index, shard in enumerate(plan["shards"]):
+        prompt, fields, _ = fit_prompt(shard, lambda f: _build_prompt(plan, f), prefix_tokens,
+                                       plan["remaining"], plan["canonical"])
+        plan["shards"][index] = fields
+        plan["prompts"].append(prompt)
+    count_fields(sent_to_llm=sum(1 for shard in plan["shards"] for f in shard if needs_filling(f)))
+
+
+def _build_prompt(plan: dict, fields: list, full: bool = False) -> str:
+    """
+    Prompt for one set of fields.
+
+    The stable part (instructions, then the profile) comes first and only
+    the form data varies after it. With a cached prefix (plan["llm"]) just
+    that form tail is returned, unless full is set for a model without the
+    cache. Without one the profile is projected down to what the fields need.
+    """
+    form_data = build_form_payload(plan["parsed_data"], fields)
+    form_text = encode_form(form_data, PROMPT_ENCODING)
+    print(f"   - Form encoding: {PROMPT_ENCODING} (~{estimate_tokens(form_text)} tokens)")
+    if os.getenv('PROMPT_ENCODING_REPORT'):
+        print(f"   - Encoding comparison (tokens): {encoding_report(form_data)}")
+
+    tail = f"""FORM DATA:
+{FORMAT_NOTES.get(PROMPT_ENCODING, "")}
+{form_text}
 
 Generate autofill actions ONLY for empty fields (should_fill: true). Skip fields already filled by fuzzy matching:"""
+    if plan.get("llm") is not None and not full:
+        return tail
+
+    canonical, aliases, fragment = plan["canonical"], plan["aliases"], plan["fragment"]
+    # Only send the profile subtrees these fields can use
+    projected, confident = project_profile(canonical, fields, aliases)
+    if confident:
+        print(f"   - Profile projection: {len(projected)}/{len(canonical)} keys")
+        profile_text = json.dumps(with_aliases(projected, aliases), separators=(",", ":"), ensure_ascii=False)
+    else:
+        print(f"   - Profile projection: low confidence, sending full profile")
+        profile_text = fragment or json.dumps(with_aliases(canonical, aliases), separators=(",", ":"), ensure_ascii=False)
+
+    return f"""
+{INSTRUCTIONS}
+
+{profile_prefix(profile_text)}
+
+{tail}"""
 
+
+async def generate(prompt: str, llm=None) -> str:
+    """Run one Gemini generation without blocking the event loop"""
+    with timed("llm_wait"):
+        async with _llm_slots:
+            response = await (llm or model).generate_content_async(prompt)
+    # The provider's prompt count (minus the cached prefix) keeps the local estimate calibrated
+    usage = getattr(response, "usage_metadata", None)
+    count_usage(usage)
+    if usage is not None and usage.prompt_token_count:
+        actual = usage.prompt_token_count - (getattr(usage, "cached_content_token_count", 0) or 0)
+        token_calibration.observe(estimate_tokens(prompt), actual)
+    return response.text
+
+
+async def generate_hedged(prompt: str, llm=None) -> str:
+    """generate() with a duplicate call racing it once it runs past the latency threshold"""
+    return await llm_hedger.run(lambda: generate(prompt, llm))
+
+
+async def generate_stream(prompt: str, llm=None):
+    """Stream one Gemini generation, yielding text chunks as they arrive"""
+    stop = start_stage("llm_wait", stream=True)
     try:
-        response = model.generate_content(prompt)
-        result = response.text
-        
-        # Clean response (remove markdown wrappers)
-        if result.startswith('```json'):
-            result = result.split('```json')[1].split('```')[0].strip()
-        elif result.startswith('```'):
-            result = result.split('```')[1].split('```')[0].strip()
-        
-        # Parse JSON to validate
-        actions = json.loads(result)
+        async with _llm_slots:
+            response = await (llm or model).generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                yield chunk.text
+    finally:
+        stop()
+    count_usage(getattr(response, "usage_metadata", None))
 
-        # Sanitize selectors in actions
-        if "actions" in actions:
-            for act in actions["actions"]:
-                act["selector"] = sanitize_selector(act.get("selector", ""))
-        
-        # Add summary if not present
-        if "summary" not in actions:
-            actions["summary"] = {
-                "total_fields": len(all_fields),
-                "already_filled": already_filled,
-                "filled_by_ai": len(actions.get("actions", [])),
-                "skipped": should_fill - len(actions.get("actions", []))
-            }
-        
-        print(f"✅ AI Generated {len(actions.get('actions', []))} actions")
-        
-        return actions
+
+def parse_response(result: str) -> dict:
+    """Strip markdown wrappers from the model output and parse it"""
+    result = result.strip()
+    if result.startswith('```json'):
+        result = result.split('```json')[1].split('```')[0].strip()
+    elif result.startswith('```'):
+        result = result.split('```')[1].split('```')[0].strip()
+    return json.loads(result)
+
+
+def parse_or_salvage(result: str) -> tuple:
+    """
+    Parse the model output, repairing it locally when it is malformed.
+
+    Returns (parsed, intact). Trailing commas, single quotes, raw newlines
+    and a response cut off mid-array are repaired; failing that the
+    incremental extractor keeps every action that was complete. intact is
+    False whenever the output needed either. A bare actions array is wrapped
+    as {"actions": [...]}. Only output without any action raises.
+    """
+    with timed("response_parse"):
+        try:
+            parsed = parse_response(result)
+        except json.JSONDecodeError:
+            count_error("malformed_output")
+            repaired = repair_json(result)
+            if isinstance(repaired, list):
+                repaired = {"actions": repaired}
+            if isinstance(repaired, dict) and isinstance(repaired.get("actions"), list):
+                print(f"⚠️  Malformed or truncated response, repaired with {len(repaired['actions'])} actions")
+                return repaired, False
+            salvaged = extract_actions(result)
+            if not salvaged:
+                raise
+            print(f"⚠️  Malformed or truncated response, salvaged {len(salvaged)} complete actions")
+            return {"actions": salvaged}, False
+        # A bare actions array is accepted like its repaired form, anything else is not an answer
+        if isinstance(parsed, list):
+            parsed = {"actions": parsed}
+        if not isinstance(parsed, dict) or not isinstance(parsed.get("actions", []), list):
+            count_error("malformed_output")
+            raise json.JSONDecodeError(f"Expected an object with an actions list, got {type(parsed).__name__}", result, 0)
+        return parsed, True
+
+
+def missing_fields(fields: list, actions: list) -> list:
+    """Fields of a shard still needing a value that no action answered"""
+    answered = {a.get("selector") for a in actions if isinstance(a, dict)}
+    return [f for f in fields if needs_filling(f) and f.get("selector") not in answered]
+
+
+async def continue_shard(plan: dict, fields: list, actions: list) -> list:
+    """
+    Re-ask the model for the fields a damaged response never reached.
+
+    Only the missing fields go into the continuation prompt, so a response
+    truncated near the end costs a small call instead of a full regeneration.
+    Returns the continuation's actions; unusable output returns none, so
+    the actions already salvaged still go through.
+    """
+    missing = missing_fields(fields, actions)
+    if not missing:
+        return []
+    print(f"🔁 Continuation call for {len(missing)} missing fields")
+    try:
+        with span("continuation", fields=len(missing)):
+            parsed, _ = parse_or_salvage(await generate_hedged(_build_prompt(plan, missing), plan["llm"]))
+    except json.JSONDecodeError:
+        print(f"⚠️  Continuation response unusable, keeping {len(actions)} salvaged actions")
+        count_error("continuation_unparseable")
+        return []
+    wanted = {f.get("selector") for f in missing}
+    return [a for a in parsed.get("actions", []) if isinstance(a, dict) and a.get("selector") in wanted]
+
+
+async def run_shard(plan: dict, index: int) -> dict:
+    """Generate one shard, completing it with a continuation call if the output was damaged"""
+    with span("shard", index=index, fields=len(plan["shards"][index])):
+        return await _run_shard(plan, index)
+
+
+async def _run_shard(plan: dict, index: int) -> dict:
+    text = await generate_hedged(plan["prompts"][index], plan["llm"])
+    unusable = None
+    try:
+        parsed, intact = parse_or_salvage(text)
+    except json.JSONDecodeError as e:
+        # Nothing usable at all, every field of the shard is missing
+        parsed, intact, unusable = {"actions": []}, False, e
+    if not intact:
+        # Repaired results are returned but never cached or learned from
+        plan["degraded"] = True
+        parsed["actions"] = parsed.get("actions", []) + \
+            await continue_shard(plan, plan["shards"][index], parsed.get("actions", []))
+        if unusable is not None and not parsed["actions"]:
+            # Neither call answered anything, fail so the client can retry
+            raise unusable
+    return parsed
+
+
+def normalize_action(act: dict) -> dict:
+    """Fold the schema's "values" list into "value" the way the extension expects"""
+    if "values" in act:
+        values = act.pop("values")
+        if act.get("action") == "select_multiple" or not act.get("value"):
+            act["value"] = values
+    return act
+
+
+def check_actions(plan: dict, actions: list) -> list:
+    """Check select answers against the full option lists, uploads are server-side only"""
+    actions = [normalize_action(a) for a in actions if isinstance(a, dict)]
+    actions = validate_option_actions(actions, plan["all_fields"])
+    return [a for a in actions if a.get("action") != "upload_file" and a.get("selector")]
+
+
+def summarize(plan: dict, filled_by_ai: int) -> dict:
+    """
+    Field counts for the whole form, always computed here.
+
+    The model's own summary only covers the fields it was shown after local
+    matching, so it is never passed through.
+    """
+    local_actions = plan["local_actions"]
+    summary = {
+        "total_fields": len(plan["all_fields"]),
+        "already_filled": plan["already_filled"],
+        "filled_by_ai": filled_by_ai,
+        "skipped": max(plan["should_fill"] - len(local_actions) - filled_by_ai, 0),
+        "matched_locally": len(local_actions),
+        "from_template": len(plan["template_actions"]),
+    }
+    if plan.get("degraded"):
+        # Salvaged from damaged model output: callers do not cache it
+        summary["degraded"] = True
+    return summary
+
+
+def finalize(plan: dict, actions: dict = None) -> dict:
+    """Validate the LLM actions and merge them with the locally resolved ones"""
+    all_fields = plan["all_fields"]
+    local_actions = plan["local_actions"]
+
+    if actions is None:
+        print(f"✅ Matched all {len(local_actions)} fields locally, skipping LLM")
+        return {"actions": sanitize_actions(local_actions), "summary": summarize(plan, 0)}
+
+    llm_actions = check_actions(plan, actions.get("actions", []))
+
+    # Remember the value-free mapping so the next user of this form skips the LLM
+    # (not from repaired output, a partial answer must not become a rule)
+    if not plan.get("degraded"):
+        profile = plan.get("profile")
+        profile_key = profile["key"] if profile else profile_hash(plan["prompt_details"])
+        form_templates.learn(plan["form_key"], all_fields, llm_actions, plan["prompt_details"], profile_key)
+
+    print(f"✅ AI Generated {len(llm_actions)} actions")
+
+    # Locally matched actions go first, the LLM never saw those fields
+    return {
+        "actions": sanitize_actions(local_actions + llm_actions),
+        "summary": summarize(plan, len(llm_actions)),
+    }
+
+
+def _confidence(act: dict) -> float:
+    try:
+        return float(act.get("confidence", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def escalate(plan: dict, result: dict) -> dict:
+    """
+    Re-ask the stronger model for the fields the fast model was unsure about.
+
+    Fields whose action falls below ESCALATION_CONFIDENCE or fails option
+    validation are sent again, together with the rest of their radio or
+    checkbox group. Where the stronger model answers a group its actions
+    replace the fast ones, otherwise the fast answer stands.
+    """
+    actions = result.get("actions", [])
+    if escalation_model is None or not actions:
+        return result
+
+    valid = {a["selector"] for a in check_actions(plan, copy.deepcopy(actions))}
+    doubtful = {a.get("selector") for a in actions
+                if isinstance(a, dict) and (_confidence(a) < ESCALATION_CONFIDENCE or a.get("selector") not in valid)}
+    prompt_fields = [f for shard in plan["shards"] for f in shard]
+    groups = {group_key(f) for f in prompt_fields if f.get("selector") in doubtful}
+    fields = [f for f in prompt_fields if group_key(f) in groups]
+    if not fields:
+        return result
+
+    print(f"⬆️  Escalating {len(fields)} fields to {ESCALATION_MODEL}")
+    # The stronger model has no cached prefix, it gets the whole prompt
+    prompt = _build_prompt(plan, fields, full=True)
+    try:
+        with span("escalation", fields=len(fields), model=ESCALATION_MODEL):
+            strong, _ = parse_or_salvage(await generate(prompt, escalation_model))
+    except json.JSONDecodeError:
+        print(f"⚠️  Escalation response unusable, keeping fast model answers")
+        count_error("escalation_unparseable")
+        return result
+    except Exception as e:
+        # Quota, timeouts or a bad ESCALATION_MODEL must not lose valid fast model answers
+        print(f"⚠️  Escalation call failed, keeping fast model answers: {type(e).__name__}: {e}")
+        count_error(f"escalation_{type(e).__name__}")
+        return result
+
+    field_groups = {f.get("selector"): group_key(f) for f in prompt_fields}
+    strong_actions = [a for a in strong.get("actions", [])
+                      if isinstance(a, dict) and field_groups.get(a.get("selector")) in groups]
+    answered = {field_groups[a["selector"]] for a in strong_actions}
+    kept = [a for a in actions if not isinstance(a, dict) or field_groups.get(a.get("selector")) not in answered]
+    return dict(result, actions=kept + strong_actions)
+
+
+def merge_results(results: list) -> dict:
+    """Combine the parsed output of several shards into one actions list"""
+    if len(results) == 1:
+        return results[0]
+    merged = {"actions": []}
+    for result in results:
+        merged["actions"].extend(result.get("actions", []))
+    return merged
+
+
+async def call_llm(parsed_data: dict, personal_details: dict, profile: dict = None) -> dict:
+    """Call Gemini to generate autofill actions"""
+    stop_build = start_stage("prompt_build")
+    plan = prepare_request(parsed_data, personal_details, profile)
+    if not plan["shards"]:
+        stop_build()
+        return finalize(plan)
+
+    try:
+        try:
+            await build_prompts(plan)
+        finally:
+            stop_build()
+        # Shards run concurrently, latency follows the largest one
+        results = await asyncio.gather(*(run_shard(plan, i) for i in range(len(plan["prompts"]))))
+        merged = await escalate(plan, merge_results(list(results)))
+        with timed("response_parse"):
+            return finalize(plan, merged)
         
+    except HTTPException as e:
+        count_error(f"http_{e.status_code}")
+        raise
     except json.JSONDecodeError as e:
+        count_error("json_parse")
         raise HTTPException(status_code=500, detail=f"JSON Parse Error: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error calling LLM: {str(e)}")
\ No newline at end of file
+        count_error(f"llm_{type(e).__name__}")
+        raise HTTPException(status_code=500, detail=f"Error calling LLM: {str(e)}")
+
+
+async def stream_llm(parsed_data: dict, personal_details: dict, profile: dict = None):
+    """
+    Yield autofill events as soon as each action is known.
+
+    Locally resolved actions come first, then every LLM action once its
+    object is complete and validated, then one final summary event carrying
+    the full result.
+    """
+    with timed("prompt_build"):
+        plan = prepare_request(parsed_data, personal_details, profile)
+        if plan["shards"]:
+            await build_prompts(plan)
+    for act in sanitize_actions(plan["local_actions"]):
+        yield {"type": "action", "action": act}
+
+    checked = []
+    if plan["prompts"]:
+        queue = asyncio.Queue()
+
+        async def run(prompt, fields):
+            try:
+                extractor = ActionExtractor()
+                streamed = []
+                async for text in generate_stream(prompt, plan["llm"]):
+                    for act in extractor.feed(text):
+                        streamed.append(act)
+                        await queue.put(act)
+                # Output cut off before the JSON closed, ask again for what it never reached
+                if not extractor.finished:
+                    plan["degraded"] = True
+                    continued = await continue_shard(plan, fields, streamed)
+                    if not streamed and not continued:
+                        raise json.JSONDecodeError("No usable actions in the streamed response", "", 0)
+                    for act in continued:
+                        await queue.put(act)
+            finally:
+                await queue.put(None)
+
+        # Shards stream concurrently into one queue
+        tasks = [asyncio.ensure_future(run(prompt, fields))
+                 for prompt, fields in zip(plan["prompts"], plan["shards"])]
+        try:
+            pending = len(tasks)
+            while pending:
+                act = await queue.get()
+                if act is None:
+                    pending -= 1
+                    continue
+                for valid in check_actions(plan, [act]):
+                    checked.append(valid)
+                    yield {"type": "action", "action": sanitize_actions([valid])[0]}
+            for task in tasks:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    result = finalize(plan, {"actions": checked}) if plan["prompts"] else finalize(plan)
+    yield {"type": "summary", "summary": result["summary"]}
\ No newline at end of file
@@ -1,8 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request, Response, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Dict, Any
-from agent import call_llm
+from typing import Dict, Any, Optional, List
+from contextlib import AsyncExitStack
+import os
+import json
+import time
+import asyncio
+from agent import call_llm, stream_llm
+from fingerprint import request_fingerprint
+from response_cache import response_cache
+from templates import form_templates
+from admission import admission
+from singleflight import autofill_flights
+from hedging import llm_hedger
+from profile_store import profile_store
+from context_cache import context_caches
+from tokens import token_calibration
+from metrics import (request_started, request_parsed, observe_request, count_error,
+                     register_gauge, exposition)
+from tracing import start_trace, current_trace, span, export
+
+# Largest /autofill/batch request, and batch items processed at once across all batch requests
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+_batch_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
 
 app = FastAPI(title="Form Autofill API", version="1.0.0")
 
@@ -13,17 +37,58 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id", "X-Autofill-Cache"],
 )
 
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """
+    Metrics and tracing around every request.
+
+    Marks the arrival time for request_parse, starts the trace (continuing
+    an incoming traceparent), returns its spans in Server-Timing with the
+    trace id in X-Trace-Id, and records total latency and error statuses.
+    """
+    started = time.perf_counter()
+    request_started.set(started)
+    trace = start_trace(request.headers.get("traceparent"))
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        observe_request(path, status, time.perf_counter() - started)
+        if not trace.deferred:
+            export(trace, f"{request.method} {path}", **{"http.status_code": status})
+
+
+# Queue and cache state sampled at scrape time
+register_gauge("autofill_admission_active", "Requests holding an admission slot", lambda: admission.active)
+register_gauge("autofill_admission_queue_depth", "Requests waiting for an admission slot", lambda: admission.waiting)
+register_gauge("autofill_inflight", "Distinct /autofill computations in flight", lambda: autofill_flights.stats()["in_flight"])
+
+
 class AutofillRequest(BaseModel):
     parsed_data: Dict[str, Any]
-    personal_details: Dict[str, Any]
+    personal_details: Optional[Dict[str, Any]] = None
+    # Id of a profile stored with PUT /profiles/{id}, replaces personal_details
+    profile_ref: Optional[str] = None
 
 
 class AutofillResponse(BaseModel):
     actions: list
-    summary: Dict[str, int] = {}
+    # Field counts, plus "degraded": true when repaired from damaged model output
+    summary: Dict[str, Any] = {}
+
+
+class BatchRequest(BaseModel):
+    items: List[AutofillRequest]
 
 
 @app.get("/")
@@ -33,7 +98,12 @@ def read_root():
         "version": "1.0.0",
         "endpoints": {
             "/autofill": "POST - Generate autofill actions",
-            "/health": "GET - Health check"
+            "/autofill/stream": "POST - Stream autofill actions as NDJSON while they are generated",
+            "/autofill/batch": "POST - Generate autofill actions for several forms in one request",
+            "/profiles/{id}": "PUT / PATCH / GET - Store personal_details server-side for profile_ref",
+            "/health": "GET - Health check",
+            "/stats": "GET - Cache, form template, admission queue and hedging statistics",
+            "/metrics": "GET - Prometheus metrics"
         }
     }
 
@@ -43,18 +113,48 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/stats")
+def stats():
+    return {
+        "response_cache": response_cache.stats(),
+        "form_templates": form_templates.stats(),
+        "admission": admission.stats(),
+        "coalescing": autofill_flights.stats(),
+        "hedging": llm_hedger.stats(),
+        "profiles": profile_store.stats(),
+        "context_cache": context_caches.stats(),
+        "token_calibration": token_calibration.stats()
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = exposition()
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/autofill", response_model=AutofillResponse)
-def generate_autofill(request: AutofillRequest):
+async def generate_autofill(
+    request: AutofillRequest,
+    response: Response,
+    x_autofill_cache: Optional[str] = Header(default=None)
+):
     """
     Generate autofill actions based on parsed form data and personal details
     
     - **parsed_data**: The parsed form structure (with filled_by markers from fuzzy matching)
     - **personal_details**: User's personal information
+    - **profile_ref**: Id of a stored profile, sent instead of personal_details
+    - **X-Autofill-Cache: bypass** header skips the response cache lookup
     
     Returns actions ONLY for fields not already filled by fuzzy matching
     """
+    request_parsed()
     try:
-        actions = call_llm(request.parsed_data, request.personal_details)
+        bypass = (x_autofill_cache or "").lower() == "bypass"
+        personal_details, profile = await resolve_profile(request)
+        actions, cache_status = await autofill(request.parsed_data, personal_details, bypass, profile)
+        response.headers["X-Autofill-Cache"] = cache_status
         return actions
     except HTTPException:
         raise
@@ -62,6 +162,215 @@ def generate_autofill(request: AutofillRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def resolve_profile(request: AutofillRequest) -> tuple:
+    """(personal_details, prepared profile or None) for a request, 400/404 on a bad reference"""
+    if request.profile_ref is None:
+        if request.personal_details is None:
+            raise HTTPException(status_code=400, detail="Either personal_details or profile_ref is required")
+        return request.personal_details, None
+    if request.personal_details is not None:
+        raise HTTPException(status_code=400, detail="Send personal_details or profile_ref, not both")
+    entry = profile_store.cached(request.profile_ref)
+    if entry is None:
+        # Loading and preparing the stored file is blocking work, keep it off the event loop
+        entry = await asyncio.to_thread(profile_store.get, request.profile_ref)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Profile {request.profile_ref} not found")
+    return entry["profile"]["details"], entry["profile"]
+
+
+async def autofill(parsed_data: dict, personal_details: dict, bypass: bool = False, profile: dict = None) -> tuple:
+    """
+    Actions for one form through the response cache, coalescing and admission.
+
+    Returns (actions, cache_status) where cache_status is HIT, MISS, BYPASS
+    or COALESCED.
+    """
+    with span("fingerprint"):
+        cache_key = request_fingerprint(parsed_data, personal_details, profile["key"] if profile else None)
+
+    if not bypass:
+        with span("cache_lookup"):
+            cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached, "HIT"
+
+    async def fill():
+        # Bounded queue in front of the LLM: fails fast with 429 + Retry-After when full
+        async with admission.admit():
+            actions = await call_llm(parsed_data, personal_details, profile)
+        # Answers salvaged from damaged model output are served once, not for the cache TTL
+        if not actions["summary"].get("degraded"):
+            with span("cache_store"):
+                response_cache.set(cache_key, actions)
+        return actions
+
+    # Identical requests already in flight share one LLM call
+    actions, coalesced = await autofill_flights.do(cache_key, fill)
+    if coalesced:
+        return actions, "COALESCED"
+    return actions, "BYPASS" if bypass else "MISS"
+
+
+@app.post("/autofill/batch")
+async def batch_autofill(
+    request: BatchRequest,
+    x_autofill_cache: Optional[str] = Header(default=None)
+):
+    """
+    Generate autofill actions for several forms at once
+
+    - **items**: list of {parsed_data, personal_details}, same as the /autofill body
+
+    Items run concurrently (at most BATCH_CONCURRENCY across all batches) and
+    share the response cache, form templates and in-flight coalescing with
+    /autofill. One failing item does not fail the batch: each result carries
+    its own status, with either actions and summary or an error detail.
+    """
+    request_parsed()
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch has no items")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+    bypass = (x_autofill_cache or "").lower() == "bypass"
+
+    async def run(index: int, item: AutofillRequest) -> dict:
+        try:
+            personal_details, profile = await resolve_profile(item)
+            async with _batch_slots:
+                actions, cache_status = await autofill(item.parsed_data, personal_details, bypass, profile)
+            return {"index": index, "status": 200, "cache": cache_status,
+                    "actions": actions.get("actions", []), "summary": actions.get("summary", {})}
+        except HTTPException as e:
+            return {"index": index, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"index": index, "status": 500, "error": str(e)}
+
+    results = await asyncio.gather(*(run(i, item) for i, item in enumerate(request.items)))
+    succeeded = sum(1 for r in results if r["status"] == 200)
+    return {
+        "results": results,
+        "summary": {"items": len(results), "succeeded": succeeded, "failed": len(results) - succeeded},
+    }
+
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+@app.post("/autofill/stream")
+async def stream_autofill(
+    request: AutofillRequest,
+    x_autofill_cache: Optional[str] = Header(default=None)
+):
+    """
+    Stream autofill actions as newline-delimited JSON
+
+    Each line is {"type": "action", "action": {...}} as soon as the action is
+    complete and validated, followed by one {"type": "summary", "summary": {...}}.
+    Failures after the stream started are sent as {"type": "error", "detail": "..."}.
+    """
+    request_parsed()
+    bypass = (x_autofill_cache or "").lower() == "bypass"
+    personal_details, profile = await resolve_profile(request)
+    with span("fingerprint"):
+        cache_key = request_fingerprint(request.parsed_data, personal_details, profile["key"] if profile else None)
+    headers = {"X-Autofill-Cache": "BYPASS" if bypass else "MISS"}
+
+    if not bypass:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            async def replay():
+                for act in cached.get("actions", []):
+                    yield _ndjson({"type": "action", "action": act})
+                yield _ndjson({"type": "summary", "summary": cached.get("summary", {})})
+            return StreamingResponse(replay(), media_type="application/x-ndjson",
+                                     headers={"X-Autofill-Cache": "HIT"})
+
+    # Take the admission slot before the response starts so overload is still a plain 429
+    stack = AsyncExitStack()
+    await stack.enter_async_context(admission.admit())
+
+    # Server-Timing only covers the work before the first byte, the full trace is exported at the end
+    trace = current_trace()
+    if trace is not None:
+        trace.deferred = True
+
+    async def events():
+        actions = []
+        status = "ok"
+        try:
+            async for event in stream_llm(request.parsed_data, personal_details, profile):
+                if event["type"] == "action":
+                    actions.append(event["action"])
+                elif not event["summary"].get("degraded"):
+                    response_cache.set(cache_key, {"actions": actions, "summary": event["summary"]})
+                yield _ndjson(event)
+        except Exception as e:
+            count_error(f"stream_{type(e).__name__}")
+            status = "error"
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield _ndjson({"type": "error", "detail": f"Error calling LLM: {detail}"})
+        finally:
+            await stack.aclose()
+            if trace is not None:
+                export(trace, "POST /autofill/stream", **{"http.status_code": 200, "stream.status": status,
+                                                          "stream.actions": len(actions)})
+
+    # aclose is idempotent, the background task covers streams that never started
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers=headers,
+                             background=BackgroundTask(stack.aclose))
+
+
+
+@app.put("/profiles/{profile_id}")
+async def put_profile(
+    profile_id: str,
+    response: Response,
+    personal_details: Dict[str, Any] = Body(...),
+    if_match: Optional[str] = Header(default=None)
+):
+    """
+    Store (or replace) a profile; the body is the personal_details object
+
+    Returns the new version with its ETag. **If-Match** makes the write
+    conditional on the current ETag (412 otherwise).
+    """
+    # Preparation and the file write run in a thread, requests keep being served meanwhile
+    entry = await asyncio.to_thread(profile_store.put, profile_id, personal_details, if_match)
+    response.headers["ETag"] = entry["etag"]
+    return {"id": profile_id, "version": entry["version"]}
+
+
+@app.patch("/profiles/{profile_id}")
+async def patch_profile(
+    profile_id: str,
+    response: Response,
+    patch: Dict[str, Any] = Body(...),
+    if_match: Optional[str] = Header(default=None)
+):
+    """Update a stored profile with a JSON merge patch (null removes a key)"""
+    entry = await asyncio.to_thread(profile_store.patch, profile_id, patch, if_match)
+    response.headers["ETag"] = entry["etag"]
+    return {"id": profile_id, "version": entry["version"]}
+
+
+@app.get("/profiles/{profile_id}")
+def get_profile(
+    profile_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None)
+):
+    """Stored profile with its version; 304 when If-None-Match matches the ETag"""
+    entry = profile_store.get(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if if_none_match == entry["etag"]:
+        return Response(status_code=304, headers={"ETag": entry["etag"]})
+    response.headers["ETag"] = entry["etag"]
+    return {"id": profile_id, "version": entry["version"], "personal_details": entry["profile"]["details"]}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8070)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import datetime
+from collections import OrderedDict
+import google.generativeai as genai
+from tokens import estimate_tokens
+
+# Cache the instructions + stored profile prefix on the provider side (0 disables)
+CONTEXT_CACHE = os.getenv('CONTEXT_CACHE', '1') != '0'
+# Lifetime of one cached prefix (seconds), and stored profiles holding one at a time
+CONTEXT_CACHE_TTL = int(os.getenv('CONTEXT_CACHE_TTL', '3600'))
+CONTEXT_CACHE_MAX_PROFILES = int(os.getenv('CONTEXT_CACHE_MAX_PROFILES', '256'))
+# Provider minimum for cached content; smaller prefixes are sent inline
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('CONTEXT_CACHE_MIN_TOKENS', '1024'))
+# A replaced cache is deleted this long after it stops being handed out (seconds),
+# in-flight requests built on it may still send continuation or hedged calls
+CONTEXT_CACHE_RETIRE_GRACE = int(os.getenv('CONTEXT_CACHE_RETIRE_GRACE', '600'))
+
+# A cache this close to expiry is replaced rather than used
+EXPIRY_MARGIN = 60
+# After a failed create the profile version is sent inline for this long
+RETRY_AFTER_FAILURE = 300
+
+
+def profile_prefix(fragment: str) -> str:
+    """The profile part of the cached prefix, also sent inline when nothing is cached"""
+    return f"PERSONAL DETAILS:\n{fragment}"
+
+
+class ContextCaches:
+    """
+    Provider-side cached content, one per stored profile version.
+
+    The prefix is the system instructions plus the full serialized profile,
+    so requests for the same profile only send the form. A new profile
+    version replaces the previous cache, least recently used profiles are
+    evicted past max_profiles, and caches are recreated before they expire.
+    Replaced caches are retired, not deleted: requests still running may use
+    them, so they are deleted retire_grace seconds later, or left to expire.
+    """
+
+    def __init__(self, enabled: bool = CONTEXT_CACHE, ttl: int = CONTEXT_CACHE_TTL,
+                 max_profiles: int = CONTEXT_CACHE_MAX_PROFILES, min_tokens: int = CONTEXT_CACHE_MIN_TOKENS,
+                 retire_grace: int = CONTEXT_CACHE_RETIRE_GRACE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_profiles = max_profiles
+        self.min_tokens = min_tokens
+        self.retire_grace = retire_grace
+        self._entries = OrderedDict()
+        self._locks = {}
+        # (delete_at, cache) for replaced caches, oldest first
+        self._retired = []
+        self.hits = 0
+        self.created = 0
+        self.failures = 0
+        self.too_small = 0
+        self.deleted = 0
+
+    def _retire(self, entry: dict):
+        """Schedule a replaced cache for deletion once in-flight requests are done with it"""
+        if entry.get("cache") is None:
+            return
+        delete_at = time.monotonic() + self.retire_grace
+        # Expiring within the grace period anyway, the provider removes it
+        if entry["expires"] <= delete_at:
+            return
+        self._retired.append((delete_at, entry["cache"]))
+
+    async def _delete_retired(self):
+        now = time.monotonic()
+        due = [cache for delete_at, cache in self._retired if delete_at <= now]
+        if not due:
+            return
+        self._retired = [(delete_at, cache) for delete_at, cache in self._retired if delete_at > now]
+        for cache in due:
+            try:
+                await asyncio.to_thread(cache.delete)
+                self.deleted += 1
+            except Exception as e:
+                print(f"⚠️  Could not delete cached content: {e}")
+
+    async def _create(self, profile: dict, model_name: str, system_instruction: str) -> dict:
+        now = time.monotonic()
+        prefix = profile_prefix(profile["fragment"])
+        if estimate_tokens(system_instruction) + estimate_tokens(prefix) < self.min_tokens:
+            self.too_small += 1
+            return {"version": profile["version"], "cache": None, "expires": float("inf")}
+        try:
+            cache = await asyncio.to_thread(
+                genai.caching.CachedContent.create,
+                model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+                display_name=f"autofill-profile-{profile['id']}-v{profile['version']}",
+                system_instruction=system_instruction,
+                contents=[prefix],
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+        except Exception as e:
+            print(f"⚠️  Context cache create failed, sending profile inline: {e}")
+            self.failures += 1
+            return {"version": profile["version"], "cache": None, "expires": now + RETRY_AFTER_FAILURE}
+        self.created += 1
+        return {"version": profile["version"], "cache": cache, "expires": now + self.ttl}
+
+    async def get(self, profile: dict, model_name: str, system_instruction: str):
+        """The cached content for this profile version, None when the prefix goes inline"""
+        if not self.enabled or not profile or profile.get("id") is None:
+            return None
+        await self._delete_retired()
+        key = (profile["id"], model_name)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            fresh = (entry is not None and entry["version"] == profile["version"]
+                     and entry["expires"] - EXPIRY_MARGIN > time.monotonic())
+            if fresh:
+                self._entries.move_to_end(key)
+                if entry["cache"] is not None:
+                    self.hits += 1
+                return entry["cache"]
+
+            # New profile version or about to expire: replace the old cache
+            if entry is not None:
+                self._retire(entry)
+            entry = await self._create(profile, model_name, system_instruction)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_profiles:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._locks.pop(old_key, None)
+                self._retire(old_entry)
+            return entry["cache"]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "profiles": len(self._entries),
+            "active_caches": sum(1 for e in self._entries.values() if e["cache"] is not None),
+            "hits": self.hits,
+            "created": self.created,
+            "retired": len(self._retired),
+            "deleted": self.deleted,
+            "failures": self.failures,
+            "below_min_tokens": self.too_small,
+        }
+
+
+context_caches = ContextCaches()
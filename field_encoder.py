@@ -0,0 +1,169 @@
+import os
+import json
+from tokens import estimate_tokens
+
+# Default encoding for FORM DATA in the prompt, see ENCODERS for the choices
+PROMPT_ENCODING = os.getenv('PROMPT_ENCODING', 'minified')
+
+KEY_ABBREVIATIONS = {
+    "selector": "s",
+    "id": "i",
+    "name": "n",
+    "type": "t",
+    "inputType": "it",
+    "section": "sec",
+    "labels": "l",
+    "directLabel": "dl",
+    "contextText": "ct",
+    "groupLabel": "gl",
+    "placeholder": "ph",
+    "precedingLabels": "pl",
+    "value": "v",
+    "isEmpty": "e",
+    "isRequired": "r",
+    "should_fill": "sf",
+    "filled_by": "fb",
+    "validation": "va",
+    "maxLength": "ml",
+    "options": "o",
+    "unselected": "u",
+    "selected": "se",
+    "fields": "f",
+}
+
+TABLE_COLUMNS = ["selector", "type", "section", "label", "context", "placeholder",
+                 "name", "value", "flags", "options"]
+
+ENCODERS = {}
+
+# One-line hint added to the prompt so the model can read the encoding
+FORMAT_NOTES = {}
+
+
+def register_encoder(name: str, note: str = ""):
+    """Register a FORM DATA encoder under a mode name"""
+    def decorator(func):
+        ENCODERS[name] = func
+        FORMAT_NOTES[name] = note
+        return func
+    return decorator
+
+
+def strip_empty(value):
+    """Recursively drop None, blank strings, empty containers and false flags"""
+    if isinstance(value, dict):
+        cleaned = {}
+        for key, item in value.items():
+            item = strip_empty(item)
+            if item is None or item is False or item == "" or item == {} or item == []:
+                continue
+            cleaned[key] = item
+        return cleaned
+    if isinstance(value, list):
+        return [strip_empty(item) for item in value]
+    if isinstance(value, str) and not value.strip():
+        return ""
+    return value
+
+
+def _compact_field(field: dict) -> dict:
+    """Strip empties and keys that only repeat another key"""
+    field = strip_empty(field)
+    if field.get("id") and field.get("selector") == f"#{field['id']}":
+        field.pop("id")
+    if field.get("inputType") == field.get("type"):
+        field.pop("inputType", None)
+    return field
+
+
+def _abbreviate(value):
+    if isinstance(value, dict):
+        return {KEY_ABBREVIATIONS.get(k, k): _abbreviate(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_abbreviate(item) for item in value]
+    return value
+
+
+@register_encoder("json")
+def encode_json(payload: dict) -> str:
+    return json.dumps(payload, indent=2)
+
+
+@register_encoder("minified", "Compact JSON: empty values and false flags are omitted.")
+def encode_minified(payload: dict) -> str:
+    compact = dict(payload, fields=[_compact_field(f) for f in payload.get("fields", [])])
+    return json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+
+
+@register_encoder("abbreviated", "Compact JSON with short keys (see KEYS legend); "
+                                 "empty values and false flags are omitted.")
+def encode_abbreviated(payload: dict) -> str:
+    compact = dict(payload, fields=[_compact_field(f) for f in payload.get("fields", [])])
+    legend = {short: full for full, short in KEY_ABBREVIATIONS.items()}
+    body = json.dumps(_abbreviate(compact), separators=(",", ":"), ensure_ascii=False)
+    return f"KEYS: {json.dumps(legend, separators=(',', ':'))}\n{body}"
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return value.replace("|", "/").replace("\n", " ").strip()
+
+
+def _table_row(field: dict) -> str:
+    labels = field.get("labels") or {}
+    label = labels.get("directLabel") or ""
+    if labels.get("groupLabel"):
+        label = f"{labels['groupLabel']}: {label}"
+
+    flags = []
+    if field.get("should_fill") is True:
+        flags.append("should_fill")
+    if field.get("filled_by"):
+        flags.append(f"filled_by={field['filled_by']}")
+    if field.get("isRequired"):
+        flags.append("required")
+    if field.get("isEmpty"):
+        flags.append("empty")
+    if (field.get("validation") or {}).get("maxLength"):
+        flags.append(f"max={field['validation']['maxLength']}")
+
+    options = field.get("options") or {}
+    rendered = []
+    for prefix, key in (("", "unselected"), ("*", "selected")):
+        for option in options.get(key) or []:
+            if not isinstance(option, (list, tuple)) or not option:
+                continue
+            text = option[1] if len(option) > 1 else option[0]
+            item = option[0] if text == option[0] else f"{option[0]}={text}"
+            rendered.append(prefix + item)
+
+    return "|".join(_cell(v) for v in [
+        field.get("selector"), field.get("type"), field.get("section"), label,
+        labels.get("contextText"), labels.get("placeholder"), field.get("name"),
+        field.get("value"), ",".join(flags), ";".join(rendered),
+    ])
+
+
+@register_encoder("tabular", "One row per field, columns separated by '|'. Options are "
+                             "'value=text' pairs separated by ';', '*' marks the selected option.")
+def encode_tabular(payload: dict) -> str:
+    lines = [f"{key}: {payload[key]}" for key in ("url", "title") if payload.get(key)]
+    lines.append("|".join(TABLE_COLUMNS))
+    lines.extend(_table_row(f) for f in payload.get("fields", []))
+    return "\n".join(lines)
+
+
+def encode_form(payload: dict, mode: str = None) -> str:
+    """Encode the form payload for the prompt with the given (or default) mode"""
+    mode = mode or PROMPT_ENCODING
+    if mode not in ENCODERS:
+        raise ValueError(f"Unknown prompt encoding '{mode}', choose from {sorted(ENCODERS)}")
+    return ENCODERS[mode](payload)
+
+
+def encoding_report(payload: dict, count_tokens=estimate_tokens) -> dict:
+    """Token count of the payload under every registered encoding"""
+    return {mode: count_tokens(encoder(payload)) for mode, encoder in ENCODERS.items()}
@@ -0,0 +1,73 @@
+import json
+import hashlib
+from matcher import resolve_path
+from uploads import strip_blobs
+from profile_canonical import canonicalize_profile, profile_hash
+
+# Keys that change on every capture of the same form and must not affect the key
+VOLATILE_KEYS = {"timestamp", "capturedAt", "requestId"}
+
+
+def _without_volatile(value):
+    if isinstance(value, dict):
+        return {k: _without_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_without_volatile(v) for v in value]
+    return value
+
+
+def _digest(value) -> str:
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def form_fingerprint(parsed_data: dict) -> str:
+    """Hash of parsed_data ignoring volatile bits like timestamp"""
+    return _digest(_without_volatile(parsed_data))
+
+
+def profile_fingerprint(personal_details: dict, stripped: tuple = None) -> str:
+    """
+    Hash of the canonicalized profile, the profile half of a request key.
+
+    The blob-free copy is canonicalized (the canonical memo must not keep
+    file payloads alive) and each blob only contributes its digest.
+    stripped is strip_blobs(personal_details) when the caller has it already.
+    """
+    prompt_details, blob_paths = stripped or strip_blobs(personal_details)
+    canonical, aliases = canonicalize_profile(prompt_details)
+    blobs = {path: hashlib.sha256(str(resolve_path(personal_details, path)).encode("utf-8")).hexdigest()
+             for path in blob_paths}
+    return profile_hash({"details": canonical, "aliases": aliases, "blobs": blobs})
+
+
+def request_fingerprint(parsed_data: dict, personal_details: dict, profile_key: str = None) -> str:
+    """Key for one autofill request: form fingerprint + canonicalized profile hash"""
+    if profile_key is None:
+        profile_key = profile_fingerprint(personal_details)
+    return hashlib.sha256(f"{form_fingerprint(parsed_data)}:{profile_key}".encode("utf-8")).hexdigest()
+
+
+def structure_fingerprint(parsed_data: dict, fields: list) -> str:
+    """
+    Hash of a form's structure only: url, selectors, types, labels and option values.
+
+    Values, fill state and fuzzy-matching markers are left out so every user
+    of the same form lands on the same fingerprint.
+    """
+    url = (parsed_data.get("url") or "").split("?")[0].split("#")[0]
+    shape = []
+    for field in fields:
+        labels = field.get("labels") or {}
+        options = field.get("options") or {}
+        listed = (options.get("unselected") or []) + (options.get("selected") or [])
+        shape.append([
+            field.get("selector"),
+            field.get("type"),
+            field.get("name"),
+            labels.get("directLabel"),
+            labels.get("contextText"),
+            labels.get("groupLabel"),
+            sorted(str(o[0]) for o in listed if isinstance(o, (list, tuple)) and o),
+        ])
+    return _digest({"url": url, "fields": shape})
@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+# Fire a duplicate generation when the first is slower than the rolling percentile (0 disables)
+LLM_HEDGE = os.getenv('LLM_HEDGE', '0') != '0'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.9'))
+# Largest share of calls that may be hedged, caps the extra load on the provider
+HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', '0.1'))
+# Latency samples needed before the threshold is trusted
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+
+LATENCY_WINDOW = 512
+
+
+class Hedger:
+    """
+    Hedged calls against tail latency.
+
+    A call still running after the rolling percentile latency gets a
+    duplicate; whichever finishes first wins and the other is cancelled. At
+    most max_rate of all calls are hedged, and nothing is hedged until
+    min_samples latencies have been seen.
+    """
+
+    def __init__(self, enabled: bool = LLM_HEDGE, percentile: float = HEDGE_PERCENTILE,
+                 max_rate: float = HEDGE_MAX_RATE, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped_rate_cap = 0
+
+    def threshold(self):
+        """Seconds after which a call is hedged, None while there are too few samples"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+
+    def _record(self, started: float):
+        self._latencies.append(time.monotonic() - started)
+
+    async def run(self, call):
+        """Await call(), hedging it with a second call() if it runs too long"""
+        self.calls += 1
+        started = time.monotonic()
+        delay = self.threshold() if self.enabled else None
+        if delay is None:
+            result = await call()
+            self._record(started)
+            return result
+
+        primary = asyncio.ensure_future(call())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or self.hedged >= self.max_rate * self.calls:
+                if not done:
+                    self.skipped_rate_cap += 1
+                result = await primary
+                self._record(started)
+                return result
+
+            self.hedged += 1
+            hedge_started = time.monotonic()
+            hedge = asyncio.ensure_future(call())
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # The primary wins ties; a failed call only counts once the other failed too
+                ordered = sorted(done, key=lambda t: t is not primary)
+                winner = next((t for t in ordered if t.exception() is None), None)
+                if winner is None and not pending:
+                    winner = ordered[0]
+                if winner is None:
+                    continue
+                if winner is primary:
+                    self.primary_wins += 1
+                    self._record(started)
+                else:
+                    self.hedge_wins += 1
+                    self._record(hedge_started)
+                return winner.result()
+        finally:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+
+    def stats(self) -> dict:
+        threshold = self.threshold()
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "skipped_rate_cap": self.skipped_rate_cap,
+            "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            "max_rate": self.max_rate,
+            "threshold_seconds": round(threshold, 4) if threshold is not None else None,
+        }
+
+
+llm_hedger = Hedger()
@@ -0,0 +1,113 @@
+import json
+
+_CLOSERS = {"{": "}", "[": "]"}
+_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def _rewrite(text: str) -> tuple:
+    """
+    One pass over the text fixing what can be fixed locally.
+
+    Converts single-quoted strings, escapes raw control characters inside
+    strings and drops trailing commas. Returns (chars, stack, cut_points,
+    in_string) where cut_points are (length, stack) pairs at which the
+    output ends on a complete value, used to cut back a truncated tail.
+    """
+    out = []
+    stack = []
+    cut_points = []
+    quote = None
+    escaped = False
+
+    start = min([i for i in (text.find("{"), text.find("[")) if i != -1], default=-1)
+    if start == -1:
+        return out, stack, cut_points, False
+
+    for char in text[start:]:
+        if quote:
+            if escaped:
+                escaped = False
+                # \' is not a JSON escape, the quote itself is enough
+                out.append(char if char == "'" and quote == "'" else "\\" + char)
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+                out.append('"')
+            elif char == '"':
+                out.append('\\"')
+            elif char in _ESCAPES:
+                out.append(_ESCAPES[char])
+            elif ord(char) < 0x20:
+                out.append(f"\\u{ord(char):04x}")
+            else:
+                out.append(char)
+            continue
+
+        if char in ('"', "'"):
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+            cut_points.append((len(out), tuple(stack)))
+        elif char in "}]":
+            while out and out[-1] in " \n\r\t":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                break
+        elif char == ",":
+            cut_points.append((len(out), tuple(stack)))
+            out.append(char)
+        elif char == "`":
+            # A closing markdown fence, the JSON is over
+            break
+        else:
+            out.append(char)
+
+    return out, stack, cut_points, quote is not None
+
+
+def _close(chars: list, stack) -> str:
+    text = "".join(chars).rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    return text + "".join(_CLOSERS[c] for c in reversed(stack))
+
+
+def repair_json(text: str):
+    """
+    Best-effort parse of malformed or truncated model output.
+
+    Handles markdown fences and chatter, single-quoted strings, raw newlines
+    inside strings, trailing commas and output cut off mid-value (the partial
+    tail is dropped back to the last complete array element). Returns the
+    parsed value or None.
+    """
+    chars, stack, cut_points, in_string = _rewrite(text)
+    if not chars:
+        return None
+
+    if not stack and not in_string:
+        try:
+            return json.loads(_close(chars, stack))
+        except json.JSONDecodeError:
+            pass
+
+    # Truncated (or still broken): cut back to the last complete element.
+    # Anything inside an action (an object below the actions array) is only
+    # kept whole, a half-written action - a cut-off value, or a "values"
+    # list missing items - must not pass as an answer.
+    for length, cut_stack in reversed(cut_points):
+        if "[" in cut_stack and "{" in cut_stack[cut_stack.index("["):]:
+            continue
+        try:
+            return json.loads(_close(chars[:length], cut_stack))
+        except json.JSONDecodeError:
+            continue
+    return None
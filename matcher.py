@@ -0,0 +1,358 @@
+import re
+
+# Values the extension's profile editor leaves behind when a field was never set
+PLACEHOLDER_VALUES = {"", "null", "none", "string", "undefined", "n/a"}
+
+# Field types the local matcher is allowed to fill
+TEXT_TYPES = {"text", "email", "tel", "url", "search", "textarea"}
+SELECT_TYPES = {"select-one", "select"}
+
+# Concept lexicon: synonyms matched against field labels, and the
+# personal_details paths that can answer the concept (first non-empty wins).
+# "exact" synonyms only match when they are the whole label (e.g. "Name"),
+# "phrases" match anywhere in the label on word boundaries.
+LEXICON = {
+    "first_name": {
+        "phrases": ["first name", "firstname", "given name", "forename", "fname"],
+        "exact": ["first"],
+        "paths": ["firstName", "first_name"],
+    },
+    "middle_name": {
+        "phrases": ["middle name", "middlename", "middle initial"],
+        "exact": ["middle"],
+        "paths": ["middleName", "middle_name"],
+    },
+    "last_name": {
+        "phrases": ["last name", "lastname", "surname", "family name", "lname"],
+        "exact": ["last"],
+        "paths": ["lastName", "last_name"],
+    },
+    "full_name": {
+        "phrases": ["full name", "fullname", "your name"],
+        "exact": ["name"],
+        "paths": ["fullName", "name"],
+    },
+    "preferred_name": {
+        "phrases": ["preferred name", "nickname", "nick name"],
+        "exact": [],
+        "paths": ["preferredName"],
+    },
+    "email": {
+        "phrases": ["email", "e mail", "email address"],
+        "exact": ["mail"],
+        "paths": ["email", "emailAddress"],
+    },
+    "home_phone": {
+        "phrases": ["home number", "home phone", "landline"],
+        "exact": [],
+        "paths": ["homePhone", "homeNumber"],
+    },
+    "phone": {
+        "phrases": ["phone", "mobile", "cell number", "cell phone", "telephone",
+                    "contact number", "phone number"],
+        "exact": ["cell", "tel"],
+        "paths": ["phone", "phoneNumber", "mobile", "cellNumber"],
+    },
+    "street_address": {
+        "phrases": ["street address", "address line 1", "addr line1", "street"],
+        "exact": ["address"],
+        "paths": ["address.streetAddress", "address.firstLine", "address.street"],
+    },
+    "address_line2": {
+        "phrases": ["street address line 2", "address line 2", "addr line2"],
+        "exact": [],
+        "paths": ["address.streetAddressLine2", "address.secondLine"],
+    },
+    "city": {
+        "phrases": ["city", "town"],
+        "exact": [],
+        "paths": ["address.city", "city"],
+    },
+    "state": {
+        "phrases": ["state", "province", "region"],
+        "exact": [],
+        "paths": ["address.state", "state"],
+    },
+    "postal": {
+        "phrases": ["postal code", "zip code", "zipcode", "zip", "postcode", "pin code", "pincode"],
+        "exact": [],
+        "paths": ["address.postal", "address.postalCode", "address.zipCode", "address.zip"],
+    },
+    "country": {
+        "phrases": ["country"],
+        "exact": [],
+        "paths": ["address.country", "country", "address.countryCode"],
+    },
+    "linkedin": {
+        "phrases": ["linkedin"],
+        "exact": [],
+        "paths": ["linkedin"],
+    },
+    "github": {
+        "phrases": ["github"],
+        "exact": [],
+        "paths": ["github"],
+    },
+    "website": {
+        "phrases": ["website", "personal site", "portfolio url"],
+        "exact": [],
+        "paths": ["website"],
+    },
+}
+
+# A more specific concept may legitimately appear next to a broader one
+# (jotform puts "Full Name" as directLabel and "First Name" as sublabel)
+CONCEPT_PARENTS = {
+    "first_name": "full_name",
+    "middle_name": "full_name",
+    "last_name": "full_name",
+    "address_line2": "street_address",
+    "home_phone": "phone",
+}
+
+# Words that mean the field belongs to someone/somewhere other than the user's
+# primary record - those are left for the LLM to disambiguate
+QUALIFIERS = {
+    "emergency", "reference", "referee", "school", "college", "university",
+    "education", "employer", "employment", "company", "work", "office",
+    "business", "previous", "former", "other", "spouse", "partner", "parent",
+    "guardian", "mother", "father", "billing", "shipping", "permanent",
+    "mailing", "manager", "supervisor", "confirm", "verify",
+    "birth", "citizenship", "nationality", "issue", "issued", "issuing", "code",
+}
+
+# Words a label may carry besides the synonym and still be clear-cut
+# ("Your City", "Mobile Number"); any other word sends the field to the LLM
+FILLER_WORDS = {
+    "your", "my", "the", "a", "enter", "please", "current", "primary",
+    "address", "number", "no", "required", "optional",
+}
+
+COUNTRY_ALIASES = {
+    "usa": "united states", "us": "united states", "u s a": "united states",
+    "united states of america": "united states", "america": "united states",
+    "uk": "united kingdom", "gb": "united kingdom", "great britain": "united kingdom",
+    "uae": "united arab emirates", "in": "india", "ind": "india",
+}
+
+MATCH_CONFIDENCE = 0.95
+
+
+def normalize_text(text) -> str:
+    """Lowercase, split camelCase and collapse punctuation into single spaces"""
+    if not isinstance(text, str):
+        return ""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    text = re.sub(r"[^a-zA-Z0-9]+", " ", text)
+    return text.lower().strip()
+
+
+def is_placeholder(value) -> bool:
+    """True for empty values and junk like 'null' / 'string' left in profiles"""
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() in PLACEHOLDER_VALUES
+    if isinstance(value, (list, dict)):
+        return len(value) == 0
+    return False
+
+
+def resolve_path(details: dict, path: str):
+    """Look up a dotted path like 'address.city' or 'educations.0.degree'"""
+    current = details
+    for part in path.split("."):
+        if isinstance(current, dict):
+            current = current.get(part)
+        elif isinstance(current, list) and part.isdigit() and int(part) < len(current):
+            current = current[int(part)]
+        else:
+            return None
+        if current is None:
+            return None
+    return current
+
+
+def needs_filling(field: dict) -> bool:
+    """Whether a field is still waiting for a value"""
+    if field.get("filled_by") == "fuzzy_matching":
+        return False
+    if "should_fill" in field:
+        return field.get("should_fill") is True
+    return field.get("isEmpty", True) is not False
+
+
+def _phrase_in(phrase: str, text: str) -> bool:
+    return f" {phrase} " in f" {text} "
+
+
+def _strip_phrases(text: str, phrases) -> str:
+    """text with every occurrence of the phrases removed, longest first"""
+    padded = f" {text} "
+    for phrase in sorted(phrases, key=len, reverse=True):
+        while f" {phrase} " in padded:
+            padded = padded.replace(f" {phrase} ", " ")
+    return padded.strip()
+
+
+_ALL_PHRASES = [p for entry in LEXICON.values() for p in entry["phrases"]]
+
+
+def _concepts_for(text: str) -> set:
+    """
+    All lexicon concepts a normalized label clearly asks for.
+
+    A synonym only counts when the rest of the label is filler words:
+    "Current city of residence" has content beyond "city" and is left to
+    the LLM.
+    """
+    found = set()
+    if not text:
+        return found
+    for concept, entry in LEXICON.items():
+        if text in entry["exact"]:
+            found.add(concept)
+        elif any(_phrase_in(p, text) for p in entry["phrases"]):
+            rest = _strip_phrases(text, entry["phrases"]).split()
+            if all(word in FILLER_WORDS for word in rest):
+                found.add(concept)
+    # A longer synonym swallows the shorter one it contains
+    # ("street address line 2" is not also a plain "street address")
+    for child, parent in CONCEPT_PARENTS.items():
+        if child in found and parent in found:
+            found.discard(parent)
+    return found
+
+
+def _field_texts(field: dict) -> list:
+    """Normalized label sources for a field, most specific first"""
+    labels = field.get("labels") or {}
+    name = field.get("name") or ""
+    # jotform style "q15_permanentAddress[city]" - the bracket part is the sublabel
+    sub = re.search(r"\[([^\]]+)\]", name)
+    return [
+        normalize_text(labels.get("contextText")),
+        normalize_text(sub.group(1)) if sub else "",
+        normalize_text(labels.get("directLabel")),
+        normalize_text(labels.get("placeholder")),
+        normalize_text(re.sub(r"^q\d+_|\d+|\[.*\]", " ", name)),
+    ]
+
+
+def _has_qualifier(field: dict) -> bool:
+    labels = field.get("labels") or {}
+    texts = [
+        labels.get("directLabel"), labels.get("contextText"), labels.get("groupLabel"),
+        labels.get("placeholder"), field.get("name"), field.get("section"),
+    ]
+    # Words inside a synonym are not qualifiers ("code" in "Zip Code", not in "Country Code")
+    words = set(" ".join(_strip_phrases(normalize_text(t), _ALL_PHRASES) for t in texts).split())
+    return bool(words & QUALIFIERS)
+
+
+def classify_field(field: dict):
+    """Return the single lexicon concept a field asks for, or None if unclear"""
+    if _has_qualifier(field):
+        return None
+
+    concept = None
+    for text in _field_texts(field):
+        found = _concepts_for(text)
+        if not found:
+            continue
+        if len(found) > 1:
+            return None
+        candidate = found.pop()
+        if concept is None:
+            concept = candidate
+        elif candidate != concept and CONCEPT_PARENTS.get(concept) != candidate:
+            # Two sources disagree and it is not a sublabel of a broader label
+            return None
+    return concept
+
+
+def match_option(value, options: list):
+    """Find the [value, text] option matching a profile value, or None"""
+    target = normalize_text(str(value))
+    if not target:
+        return None
+    target = COUNTRY_ALIASES.get(target, target)
+    for option in options:
+        if not isinstance(option, (list, tuple)) or not option:
+            continue
+        option_value = option[0]
+        option_text = option[1] if len(option) > 1 else option[0]
+        for candidate in (option_value, option_text):
+            normalized = normalize_text(str(candidate))
+            if normalized and COUNTRY_ALIASES.get(normalized, normalized) == target:
+                return option_value
+    return None
+
+
+def _profile_value(concept: str, personal_details: dict):
+    for path in LEXICON[concept]["paths"]:
+        value = resolve_path(personal_details, path)
+        if isinstance(value, (str, int, float)) and not is_placeholder(value):
+            return path, value
+    return None, None
+
+
+def _field_options(field: dict) -> list:
+    options = field.get("options") or {}
+    return (options.get("unselected") or []) + (options.get("selected") or [])
+
+
+def _label_for(field: dict) -> str:
+    labels = field.get("labels") or {}
+    return labels.get("directLabel") or labels.get("contextText") or field.get("selector", "")
+
+
+def match_field(field: dict, personal_details: dict):
+    """Resolve one field to an action straight from personal_details, or None"""
+    field_type = (field.get("type") or "").lower()
+    if field_type not in TEXT_TYPES and field_type not in SELECT_TYPES:
+        return None
+
+    concept = classify_field(field)
+    if concept is None:
+        return None
+    path, value = _profile_value(concept, personal_details)
+    if path is None:
+        return None
+
+    if concept == "email" and "@" not in str(value):
+        return None
+
+    if field_type in SELECT_TYPES:
+        option_value = match_option(value, _field_options(field))
+        if option_value is None:
+            return None
+        action, value = "select", option_value
+    else:
+        action, value = "fill", str(value)
+
+    return {
+        "selector": field.get("selector", ""),
+        "action": action,
+        "value": value,
+        "confidence": MATCH_CONFIDENCE,
+        "reasoning": f"Matched '{_label_for(field)}' to {path} (local lexicon)",
+        "source": path,
+    }
+
+
+def match_fields(fields: list, personal_details: dict) -> tuple:
+    """
+    Resolve unambiguous fields locally.
+
+    Returns (actions, remaining_fields) where remaining_fields still need the LLM.
+    """
+    actions = []
+    remaining = []
+    for field in fields:
+        action = match_field(field, personal_details) if needs_filling(field) else None
+        if action and action["selector"]:
+            actions.append(action)
+        else:
+            remaining.append(field)
+    return actions, remaining
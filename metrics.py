@@ -0,0 +1,103 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from tracing import start_span, end_span, add_span, current_trace
+
+# Pipeline stages timed per request (request_parse: body read + validation before the handler runs)
+STAGES = ("request_parse", "prompt_build", "llm_wait", "response_parse")
+
+# Covers local-only requests (ms) up to slow multi-shard LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "autofill_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    "autofill_request_seconds", "Total request latency by route", ["route"], buckets=LATENCY_BUCKETS)
+FIELDS = Counter(
+    "autofill_fields_total", "Form fields seen, by status", ["status"])
+LLM_TOKENS = Counter(
+    "autofill_llm_tokens_total", "Tokens reported by Gemini usage metadata", ["kind"])
+ERRORS = Counter(
+    "autofill_errors_total", "Pipeline errors by type", ["type"])
+HTTP_ERRORS = Counter(
+    "autofill_http_errors_total", "Responses with a 4xx/5xx status", ["route", "status"])
+
+# Set by the middleware when a request arrives, read when the handler starts
+request_started = ContextVar("request_started", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def timed(stage: str, **attributes):
+    """Time the block into the stage histogram and as a trace span"""
+    stop = start_stage(stage, **attributes)
+    try:
+        yield
+    finally:
+        stop()
+
+
+def start_stage(stage: str, **attributes):
+    """Start timing a stage that does not fit a with block; returns the function that stops it"""
+    start = time.perf_counter()
+    current = start_span(stage, **attributes)
+    stopped = False
+
+    def stop():
+        nonlocal stopped
+        if not stopped:
+            stopped = True
+            end_span(current)
+            observe_stage(stage, time.perf_counter() - start)
+    return stop
+
+
+def request_parsed():
+    """Record request_parse for the current request; call first thing in a handler"""
+    started = request_started.get()
+    if started is not None:
+        observe_stage("request_parse", time.perf_counter() - started)
+    trace = current_trace()
+    if trace is not None:
+        add_span("request_parse", trace.start_ns)
+
+
+def count_fields(**counts):
+    for status, count in counts.items():
+        if count:
+            FIELDS.labels(status).inc(count)
+
+
+def count_usage(usage):
+    """Add a response's usage_metadata to the token counters"""
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                       ("cached", "cached_content_token_count")):
+        count = getattr(usage, attr, 0) or 0
+        if count:
+            LLM_TOKENS.labels(kind).inc(count)
+
+
+def count_error(kind: str):
+    ERRORS.labels(kind).inc()
+
+
+def register_gauge(name: str, description: str, read):
+    """Gauge sampled from read() at scrape time, for state owned by other modules"""
+    Gauge(name, description).set_function(read)
+
+
+def observe_request(route: str, status: int, seconds: float):
+    REQUEST_SECONDS.labels(route).observe(seconds)
+    if status >= 400:
+        HTTP_ERRORS.labels(route, str(status)).inc()
+
+
+def exposition() -> tuple:
+    """(body, content_type) for the /metrics endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,144 @@
+import os
+from matcher import normalize_text, is_placeholder, COUNTRY_ALIASES
+
+# Only lists longer than OPTION_PRUNE_MIN are pruned, down to OPTION_TOP_K candidates
+OPTION_TOP_K = int(os.getenv('OPTION_TOP_K', '8'))
+OPTION_PRUNE_MIN = int(os.getenv('OPTION_PRUNE_MIN', '20'))
+
+# Sentinel the model answers with when none of the shown candidates fit
+OTHER_OPTION = "__other__"
+
+OPTION_ACTIONS = {"select", "radio_select", "select_multiple"}
+
+# Filler words that would otherwise make "Republic of the Congo" look close to everything
+STOPWORDS = {"of", "the", "and", "a", "an", "in", "on", "for", "to", "or"}
+
+
+def _normalize(value) -> str:
+    text = normalize_text(str(value))
+    return COUNTRY_ALIASES.get(text, text)
+
+
+def profile_values(personal_details: dict) -> set:
+    """Normalized scalar values found anywhere in personal_details"""
+    values = set()
+    stack = [personal_details]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, (str, int, float)) and not isinstance(node, bool):
+            if not is_placeholder(node):
+                normalized = _normalize(node)
+                if normalized:
+                    values.add(normalized)
+    return values
+
+
+def _score(option, values: set) -> float:
+    """How well a [value, text] option matches any profile value"""
+    best = 0.0
+    for candidate in {_normalize(part) for part in option[:2]}:
+        if not candidate:
+            continue
+        if candidate in values:
+            return 1.0
+        tokens = set(candidate.split()) - STOPWORDS
+        for value in values:
+            if len(candidate) >= 3 and len(value) >= 3 and (
+                    f" {candidate} " in f" {value} " or f" {value} " in f" {candidate} "):
+                best = max(best, 0.8)
+                continue
+            value_tokens = set(value.split()) - STOPWORDS
+            overlap = tokens & value_tokens
+            if overlap:
+                best = max(best, 0.6 * len(overlap) / len(tokens | value_tokens))
+    return best
+
+
+def prune_field_options(field: dict, values: set, top_k: int = OPTION_TOP_K,
+                        prune_min: int = OPTION_PRUNE_MIN) -> dict:
+    """Copy of field with options.unselected cut to the top_k best candidates"""
+    options = field.get("options") or {}
+    unselected = [o for o in options.get("unselected") or [] if isinstance(o, (list, tuple)) and o]
+    if len(unselected) <= prune_min:
+        return field
+
+    ranked = sorted(enumerate(unselected), key=lambda item: (-_score(item[1], values), item[0]))
+    kept = sorted(ranked[:top_k], key=lambda item: item[0])
+    hidden = len(unselected) - len(kept)
+
+    pruned = dict(field)
+    pruned["options"] = dict(options)
+    pruned["options"]["unselected"] = [list(option) for _, option in kept] + [
+        [OTHER_OPTION, f"None of these ({hidden} more options not shown)"]
+    ]
+    return pruned
+
+
+def prune_options(fields: list, personal_details: dict, top_k: int = OPTION_TOP_K) -> list:
+    """Prune every long option list against the user's profile values"""
+    values = None
+    pruned_fields = []
+    for field in fields:
+        options = (field.get("options") or {}).get("unselected") or []
+        if len(options) > OPTION_PRUNE_MIN:
+            if values is None:
+                values = profile_values(personal_details)
+            field = prune_field_options(field, values, top_k)
+        pruned_fields.append(field)
+    return pruned_fields
+
+
+def _resolve_option(value, options: list):
+    """Map a model answer (option value or text) back to the option value"""
+    for option in options:
+        if option[0] == value:
+            return option[0]
+    target = _normalize(value)
+    for option in options:
+        if any(_normalize(part) == target for part in option[:2]):
+            return option[0]
+    return None
+
+
+def validate_option_actions(actions: list, fields: list) -> list:
+    """
+    Check select-style actions against the full, unpruned option lists.
+
+    Answers given as option text are mapped to the option value; the
+    "__other__" sentinel and values not in the list are dropped.
+    """
+    full_options = {}
+    for field in fields:
+        options = field.get("options") or {}
+        listed = (options.get("unselected") or []) + (options.get("selected") or [])
+        listed = [o for o in listed if isinstance(o, (list, tuple)) and o]
+        if listed:
+            full_options[field.get("selector")] = listed
+
+    valid = []
+    for act in actions:
+        options = full_options.get(act.get("selector"))
+        if act.get("action") not in OPTION_ACTIONS or options is None:
+            valid.append(act)
+            continue
+
+        value = act.get("value")
+        if isinstance(value, list):
+            resolved = [_resolve_option(v, options) for v in value if v != OTHER_OPTION]
+            resolved = [v for v in resolved if v is not None]
+            if not resolved:
+                print(f"⚠️  Dropped {act.get('selector')}: no valid options in {value}")
+                continue
+            act["value"] = resolved
+        else:
+            resolved = _resolve_option(value, options) if value != OTHER_OPTION else None
+            if resolved is None:
+                print(f"⚠️  Dropped {act.get('selector')}: '{value}' is not a valid option")
+                continue
+            act["value"] = resolved
+        valid.append(act)
+    return valid
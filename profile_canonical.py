@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from matcher import is_placeholder
+
+# How many canonicalized profiles are kept in memory
+CANONICAL_CACHE_SIZE = int(os.getenv('CANONICAL_CACHE_SIZE', '256'))
+
+# Key added to the prompt copy of personal_details listing the collapsed aliases
+ALIASES_KEY = "_aliases"
+
+_cache = OrderedDict()
+# Used from the event loop and from threads (profile writes), lookups and evictions must not interleave
+_cache_lock = threading.Lock()
+
+
+def profile_hash(personal_details: dict) -> str:
+    """Stable hash of a profile, independent of key order"""
+    encoded = json.dumps(personal_details, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _drop_placeholders(value):
+    """Remove placeholder junk inside list records without collapsing anything"""
+    if isinstance(value, dict):
+        cleaned = {k: _drop_placeholders(v) for k, v in value.items()}
+        return {k: v for k, v in cleaned.items() if not is_placeholder(v)}
+    if isinstance(value, list):
+        cleaned = [_drop_placeholders(v) for v in value]
+        return [v for v in cleaned if not is_placeholder(v)]
+    return value
+
+
+def _canonicalize(personal_details: dict) -> tuple:
+    seen = {}
+    aliases = {}
+
+    def walk(node: dict, prefix: str) -> dict:
+        result = {}
+        for key, value in node.items():
+            path = f"{prefix}.{key}" if prefix else key
+            if isinstance(value, dict):
+                child = walk(value, path)
+                if child:
+                    result[key] = child
+                continue
+            # Lists of records (educations, experiences) stay intact
+            if isinstance(value, list) and any(isinstance(v, (dict, list)) for v in value):
+                value = _drop_placeholders(value)
+            if is_placeholder(value):
+                continue
+            signature = json.dumps(value, sort_keys=True, default=str)
+            if signature in seen:
+                aliases.setdefault(seen[signature], []).append(path)
+                continue
+            seen[signature] = path
+            result[key] = value
+        return result
+
+    return walk(personal_details, ""), aliases
+
+
+def canonicalize_profile(personal_details: dict) -> tuple:
+    """
+    Collapse keys holding identical values and drop placeholder values.
+
+    Returns (canonical_details, aliases) where aliases maps each kept dotted
+    path to the paths that held the same value. Results are memoized per
+    profile hash and shared between requests - treat them as read-only.
+    """
+    key = profile_hash(personal_details)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    result = _canonicalize(personal_details)
+    with _cache_lock:
+        _cache[key] = result
+        if len(_cache) > CANONICAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def aliases_for(details: dict, aliases: dict) -> dict:
+    """Aliases restricted to paths whose top-level key survived in details"""
+    return {path: names for path, names in aliases.items() if path.split(".")[0] in details}
+
+
+def with_aliases(details: dict, aliases: dict) -> dict:
+    """Prompt copy of details with the relevant alias list attached"""
+    relevant = aliases_for(details, aliases)
+    if not relevant:
+        return details
+    return {**details, ALIASES_KEY: relevant}
@@ -0,0 +1,144 @@
+import os
+from matcher import normalize_text, needs_filling
+
+# Share of fields that must be explained by the projected profile, below it the full profile is sent
+PROJECTION_MIN_COVERAGE = float(os.getenv('PROJECTION_MIN_COVERAGE', '0.8'))
+
+# Always sent: every form identifies the applicant somehow
+CORE_KEYS = {"name", "firstName", "lastName", "middleName", "fullName", "email", "phone", "phoneNumber"}
+CORE_TRIGGERS = {"name", "email", "mail", "phone", "mobile", "cell", "telephone", "contact"}
+
+# Topic: words that trigger it in form labels, and words that select profile keys for it
+TOPICS = {
+    "address": {
+        "triggers": {"address", "street", "city", "state", "province", "postal", "zip",
+                     "postcode", "country", "town", "residence", "location"},
+        "keys": {"address", "street", "city", "state", "postal", "zip", "country"},
+    },
+    "birth": {
+        "triggers": {"birth", "dob", "birthday", "born", "age", "date", "day", "month", "year"},
+        "keys": {"dob", "birth", "birthday", "age"},
+    },
+    "education": {
+        "triggers": {"school", "college", "university", "education", "degree", "major",
+                     "gpa", "graduation", "institution", "study", "studies", "qualification"},
+        "keys": {"education", "educations", "school", "college", "university", "degree",
+                 "major", "high"},
+    },
+    "employment": {
+        "triggers": {"company", "employer", "employment", "job", "title", "position",
+                     "occupation", "industry", "place", "experience", "notice", "salary"},
+        "keys": {"company", "employer", "job", "title", "occupation", "industry", "place",
+                 "experiences", "experience", "notice", "salary"},
+    },
+    "availability": {
+        "triggers": {"available", "availability", "hours", "shift", "authorized",
+                     "authorization", "visa", "sponsorship", "relocate", "start"},
+        "keys": {"availability", "available", "authorization", "location"},
+    },
+    "references": {
+        "triggers": {"reference", "references", "referee"},
+        "keys": {"reference"},
+    },
+    "emergency": {
+        "triggers": {"emergency"},
+        "keys": {"emergency"},
+    },
+    "banking": {
+        "triggers": {"bank", "account", "routing", "iban", "swift"},
+        "keys": {"bank", "account"},
+    },
+    "documents": {
+        "triggers": {"ssn", "social", "passport", "license", "licence", "identification"},
+        "keys": {"ssn", "passport", "drivers", "license"},
+    },
+    "online": {
+        "triggers": {"linkedin", "github", "website", "portfolio", "url", "profile"},
+        "keys": {"linkedin", "github", "website", "portfolio"},
+    },
+    "skills": {
+        "triggers": {"skill", "skills", "language", "languages", "spoken", "proficiency"},
+        "keys": {"skills", "languages", "language"},
+    },
+    "personal": {
+        "triggers": {"gender", "sex", "marital", "nationality", "citizenship", "citizen",
+                     "preferred", "nickname", "pronoun", "pronouns"},
+        "keys": {"gender", "marital", "nationality", "citizenship", "preferred"},
+    },
+}
+
+
+def _field_tokens(field: dict) -> set:
+    labels = field.get("labels") or {}
+    texts = [labels.get("directLabel"), labels.get("contextText"), labels.get("groupLabel"),
+             labels.get("placeholder"), field.get("name"), field.get("section")]
+    texts.extend(labels.get("precedingLabels") or [])
+    return set(" ".join(normalize_text(t) for t in texts if isinstance(t, str)).split())
+
+
+def _key_tokens(key: str, value, alias_names: list) -> set:
+    tokens = set(normalize_text(key).split())
+    tokens.add(key.lower())
+    if isinstance(value, dict):
+        for child in value:
+            tokens |= set(normalize_text(child).split())
+    for alias in alias_names:
+        for part in alias.split("."):
+            tokens |= set(normalize_text(part).split())
+    return tokens
+
+
+def _aliases_by_key(aliases: dict) -> dict:
+    """Alias paths grouped under the top-level key they collapsed into"""
+    grouped = {}
+    for path, names in (aliases or {}).items():
+        grouped.setdefault(path.split(".")[0], []).extend(names)
+    return grouped
+
+
+def _name_in(name: str, vocabulary: set) -> bool:
+    tokens = set(normalize_text(name.split(".")[-1]).split())
+    return bool(tokens) and tokens <= vocabulary
+
+
+def project_profile(personal_details: dict, fields: list, aliases: dict = None) -> tuple:
+    """
+    Keep only the profile subtrees plausibly needed by the given fields.
+
+    aliases (from profile_canonical) lets a collapsed key be kept for the
+    names of the keys it absorbed.
+
+    Returns (projected_details, confident). When the topics found in the
+    field labels do not explain enough of the fields, confident is False and
+    callers should fall back to the full profile.
+    """
+    pending = [f for f in fields if needs_filling(f)]
+    if not pending:
+        return personal_details, False
+
+    vocabulary = set()
+    topics = set()
+    explained = 0
+    for field in pending:
+        tokens = _field_tokens(field)
+        vocabulary |= tokens
+        field_topics = {name for name, topic in TOPICS.items() if tokens & topic["triggers"]}
+        topics |= field_topics
+        if field_topics or tokens & CORE_TRIGGERS:
+            explained += 1
+
+    wanted = set()
+    for name in topics:
+        wanted |= TOPICS[name]["keys"]
+
+    alias_names = _aliases_by_key(aliases)
+    projected = {}
+    for key, value in personal_details.items():
+        names = [key] + alias_names.get(key, [])
+        if (any(name in CORE_KEYS for name in names)
+                or _key_tokens(key, value, alias_names.get(key, [])) & wanted
+                or any(_name_in(name, vocabulary) for name in names)):
+            projected[key] = value
+
+    coverage = explained / len(pending)
+    return projected, coverage >= PROJECTION_MIN_COVERAGE
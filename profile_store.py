@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import threading
+from fastapi import HTTPException
+from uploads import strip_blobs
+from profile_canonical import canonicalize_profile, with_aliases, profile_hash
+from fingerprint import profile_fingerprint
+
+# Directory the profiles are persisted to as <id>.json ("" keeps them in memory only)
+PROFILE_STORE_DIR = os.getenv('PROFILE_STORE_DIR', '')
+
+# Ids double as file names
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$")
+
+
+def merge_patch(target, patch):
+    """RFC 7386 JSON merge patch: objects merge recursively, null deletes a key"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def prepare_profile(personal_details: dict) -> dict:
+    """
+    Everything the pipeline derives from a profile, computed once per version.
+
+    Holds the blob-free prompt copy, its canonical form and aliases, the
+    serialized full-profile prompt fragment and the request cache key part.
+    Shared between requests - treat it as read-only.
+    """
+    prompt_details, blob_paths = strip_blobs(personal_details)
+    canonical, aliases = canonicalize_profile(prompt_details)
+    return {
+        "details": personal_details,
+        "prompt_details": prompt_details,
+        "blob_paths": blob_paths,
+        "canonical": canonical,
+        "aliases": aliases,
+        "fragment": json.dumps(with_aliases(canonical, aliases), separators=(",", ":"), ensure_ascii=False),
+        "key": profile_fingerprint(personal_details, (prompt_details, blob_paths)),
+    }
+
+
+class ProfileStore:
+    """
+    Versioned personal_details kept server-side under a profile id.
+
+    Every write bumps the version and precomputes the prepared profile, so
+    /autofill requests referencing the id skip validation, canonicalization
+    and serialization of the blob. With a directory configured, profiles
+    are written through to <id>.json and loaded lazily.
+
+    Preparation and disk I/O never run under the lock readers take, so a
+    write does not hold up requests reading from the event loop.
+    """
+
+    def __init__(self, directory: str = PROFILE_STORE_DIR):
+        self.directory = directory
+        self._profiles = {}
+        # Guards _profiles only, held for lookups and swaps
+        self._lock = threading.Lock()
+        # Serializes writers so versions follow each other; readers never take it
+        self._write_lock = threading.RLock()
+
+    @staticmethod
+    def _check_id(profile_id: str):
+        if not PROFILE_ID_PATTERN.match(profile_id or ""):
+            raise HTTPException(status_code=400, detail=f"Invalid profile id: {profile_id!r}")
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def _load(self, profile_id: str):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(profile_id), encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return self._entry(profile_id, stored["details"], stored["version"])
+
+    def _entry(self, profile_id: str, details: dict, version: int) -> dict:
+        # id + version let the provider-side context cache follow profile versions
+        profile = prepare_profile(details)
+        profile["id"] = profile_id
+        profile["version"] = version
+        return {
+            "version": version,
+            "etag": f'"{version}-{profile_hash(details)[:16]}"',
+            "profile": profile,
+        }
+
+    def _save(self, profile_id: str, entry: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(profile_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": entry["version"], "details": entry["profile"]["details"]}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(profile_id))
+
+    def cached(self, profile_id: str):
+        """The in-memory entry for an id, None if not loaded; no I/O, safe on the event loop"""
+        self._check_id(profile_id)
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def get(self, profile_id: str):
+        """The entry ({version, etag, profile}) for an id, None if unknown; may read the disk"""
+        entry = self.cached(profile_id)
+        if entry is not None or not self.directory:
+            return entry
+        loaded = self._load(profile_id)
+        if loaded is None:
+            return None
+        with self._lock:
+            # A write that finished while loading wins over the file read
+            return self._profiles.setdefault(profile_id, loaded)
+
+    def put(self, profile_id: str, details: dict, if_match: str = None) -> dict:
+        """
+        Store a new version of the profile and return its entry.
+
+        if_match, when given, must equal the current ETag ("*" only requires
+        that the profile exists), otherwise 412 is raised.
+        """
+        with self._write_lock:
+            current = self.get(profile_id)
+            if if_match is not None and (current is None or if_match not in ("*", current["etag"])):
+                raise HTTPException(status_code=412, detail="Profile changed or does not exist (If-Match)")
+            entry = self._entry(profile_id, details, (current["version"] if current else 0) + 1)
+            if self.directory:
+                self._save(profile_id, entry)
+            with self._lock:
+                self._profiles[profile_id] = entry
+            return entry
+
+    def patch(self, profile_id: str, patch: dict, if_match: str = None) -> dict:
+        """Apply a JSON merge patch to a stored profile, 404 if it does not exist"""
+        with self._write_lock:
+            current = self.get(profile_id)
+            if current is None:
+                raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+            return self.put(profile_id, merge_patch(current["profile"]["details"], patch), if_match)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"profiles": len(self._profiles), "persisted": bool(self.directory)}
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,73 @@
+import os
+from fastapi import HTTPException
+from matcher import needs_filling
+from option_pruning import prune_field_options, profile_values
+from tokens import calibrated_tokens, token_calibration
+
+# Calibrated prompt tokens allowed per LLM call (cached prefix included), 0 disables the guard
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '32000'))
+
+# Trimming limits applied when a prompt is over budget
+BUDGET_OPTION_TOP_K = 3
+CONTEXT_TEXT_MAX = 80
+
+
+def drop_filled(fields: list, originals: dict, details: dict) -> list:
+    """Fields that need no value only give context, they go first"""
+    return [f for f in fields if needs_filling(f)]
+
+
+def prune_harder(fields: list, originals: dict, details: dict) -> list:
+    """Every option list cut to BUDGET_OPTION_TOP_K candidates, from the full list"""
+    values = profile_values(details)
+    return [prune_field_options(originals.get(f.get("selector"), f), values,
+                                BUDGET_OPTION_TOP_K, BUDGET_OPTION_TOP_K) for f in fields]
+
+
+def shorten_context(fields: list, originals: dict, details: dict) -> list:
+    """Long contextText cut to CONTEXT_TEXT_MAX characters"""
+    shortened = []
+    for field in fields:
+        labels = field.get("labels") or {}
+        text = labels.get("contextText")
+        if isinstance(text, str) and len(text) > CONTEXT_TEXT_MAX:
+            field = dict(field, labels=dict(labels, contextText=text[:CONTEXT_TEXT_MAX] + "…"))
+        shortened.append(field)
+    return shortened
+
+
+# Applied in order until the prompt fits
+TRIM_STEPS = [drop_filled, prune_harder, shorten_context]
+
+
+def fit_prompt(fields: list, build, prefix_tokens: int = 0, originals: list = (),
+               details: dict = None, budget: int = PROMPT_TOKEN_BUDGET) -> tuple:
+    """
+    Build the prompt for fields, trimming them until it fits the token budget.
+
+    build(fields) returns the prompt text; prefix_tokens counts a cached
+    prefix sent alongside it. originals are the untrimmed fields, used to
+    re-prune option lists. Returns (prompt, fields, tokens) and raises 413
+    when even the fully trimmed prompt is over budget.
+    """
+    prompt = build(fields)
+    tokens = prefix_tokens + calibrated_tokens(prompt)
+    trimmed = []
+    by_selector = {f.get("selector"): f for f in originals}
+    for step in TRIM_STEPS:
+        if budget <= 0 or tokens <= budget:
+            break
+        fields = step(fields, by_selector, details or {})
+        prompt = build(fields)
+        tokens = prefix_tokens + calibrated_tokens(prompt)
+        trimmed.append(step.__name__)
+
+    print(f"   - Prompt estimate: ~{tokens} tokens (calibration x{token_calibration.ratio:.2f}"
+          f"{', budget ' + str(budget) if budget > 0 else ''}"
+          f"{', trimmed: ' + ', '.join(trimmed) if trimmed else ''})")
+    if budget > 0 and tokens > budget:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Form too large: prompt is ~{tokens} tokens after trimming, budget is {budget}",
+        )
+    return prompt, fields, tokens
@@ -0,0 +1,46 @@
+def _walk_sections(sections: list, parents: tuple = ()):
+    """Yield (section_path, field) for every field in nested sections/subsections"""
+    for section in sections or []:
+        heading = (section.get("heading") or "").strip()
+        path = parents + (heading,) if heading else parents
+        for field in section.get("fields", []) or []:
+            yield " > ".join(path), field
+        yield from _walk_sections(section.get("subsections", []), path)
+
+
+def collect_fields(parsed_data: dict) -> list:
+    """
+    Merge sections[].fields/subsections and allFields into one list keyed by selector.
+
+    The extension sends every field twice; section order is kept and each field
+    gets a "section" key with its heading path so the model keeps that context.
+    Fields only present in allFields are appended at the end.
+    """
+    merged = {}
+    for section_path, field in _walk_sections(parsed_data.get("sections", [])):
+        selector = field.get("selector")
+        if not selector:
+            continue
+        entry = merged.setdefault(selector, {})
+        entry.update(field)
+        if section_path and "section" not in entry:
+            entry["section"] = section_path
+
+    for field in parsed_data.get("allFields", []) or []:
+        selector = field.get("selector")
+        if not selector:
+            continue
+        # allFields carries the fuzzy-matching markers, let them win
+        merged.setdefault(selector, {}).update(field)
+
+    return list(merged.values())
+
+
+def build_form_payload(parsed_data: dict, fields: list) -> dict:
+    """Form-level context plus the deduplicated field list, ready for the prompt"""
+    payload = {}
+    for key in ("url", "title"):
+        if parsed_data.get(key):
+            payload[key] = parsed_data[key]
+    payload["fields"] = fields
+    return payload
@@ -0,0 +1,84 @@
+import os
+import re
+from matcher import needs_filling
+
+# Estimated FORM DATA tokens per LLM call; 0 keeps every form in a single call
+SHARD_TOKEN_BUDGET = int(os.getenv('SHARD_TOKEN_BUDGET', '4000'))
+
+
+def group_key(field: dict) -> str:
+    """
+    Key shared by fields that must be answered together.
+
+    Composite inputs ("q15_permanentAddress[city]"), checkbox arrays
+    ("q20_gender20[]") and radio groups share a name or group label.
+    """
+    name = re.sub(r"\[[^\]]*\]$", "", field.get("name") or "")
+    if name:
+        return f"name:{name}"
+    group_label = (field.get("labels") or {}).get("groupLabel")
+    if group_label:
+        return f"group:{field.get('section', '')}:{group_label}"
+    return f"field:{field.get('selector', '')}"
+
+
+def _units(fields: list) -> list:
+    """Consecutive fields grouped by section, and within a section by group_key"""
+    sections = []
+    for field in fields:
+        section = field.get("section", "")
+        if not sections or sections[-1][0] != section:
+            sections.append((section, []))
+        groups = sections[-1][1]
+        key = group_key(field)
+        for existing_key, members in groups:
+            if existing_key == key:
+                members.append(field)
+                break
+        else:
+            groups.append((key, [field]))
+    return [[members for _, members in groups] for _, groups in sections]
+
+
+def shard_fields(fields: list, count_tokens, budget: int = SHARD_TOKEN_BUDGET) -> list:
+    """
+    Split fields into shards whose estimated size stays under budget.
+
+    Whole sections are packed together when they fit; a section larger than
+    the budget is split between its groups, never inside one. Shards with
+    nothing left to fill are dropped.
+    """
+    if budget <= 0:
+        return [fields] if any(needs_filling(f) for f in fields) else []
+
+    shards = []
+    current, current_tokens = [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            shards.append(current)
+        current, current_tokens = [], 0
+
+    for section_groups in _units(fields):
+        section_fields = [f for group in section_groups for f in group]
+        section_tokens = sum(count_tokens(f) for f in section_fields)
+        if section_tokens <= budget:
+            if current_tokens + section_tokens > budget:
+                flush()
+            current.extend(section_fields)
+            current_tokens += section_tokens
+            continue
+
+        # Oversized section: pack its groups, starting on a fresh shard
+        flush()
+        for group in section_groups:
+            group_tokens = sum(count_tokens(f) for f in group)
+            if current and current_tokens + group_tokens > budget:
+                flush()
+            current.extend(group)
+            current_tokens += group_tokens
+        flush()
+    flush()
+
+    return [shard for shard in shards if any(needs_filling(f) for f in shard)]
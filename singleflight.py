@@ -0,0 +1,48 @@
+import copy
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution.
+
+    The first caller starts the work as its own task; callers arriving while
+    it runs await the same task. Every caller gets its own deep copy of the
+    result, and a caller disconnecting does not cancel the shared work.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, func) -> tuple:
+        """Run func() once per key at a time; returns (result, was_coalesced)"""
+        task = self._flights.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.leaders += 1
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result), coalesced
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+autofill_flights = SingleFlight()
@@ -0,0 +1,189 @@
+import os
+import threading
+from collections import OrderedDict
+from matcher import normalize_text, resolve_path, is_placeholder, needs_filling, match_option
+
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', '2048'))
+
+# Only LLM answers at least this confident are turned into template rules
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv('TEMPLATE_MIN_CONFIDENCE', '0.85'))
+# Distinct profiles that must produce the same rule before it is applied to anyone
+TEMPLATE_MIN_PROFILES = int(os.getenv('TEMPLATE_MIN_PROFILES', '2'))
+
+TEMPLATE_CONFIDENCE = 0.9
+
+
+def _field_options(field: dict) -> list:
+    options = field.get("options") or {}
+    listed = (options.get("unselected") or []) + (options.get("selected") or [])
+    return [o for o in listed if isinstance(o, (list, tuple)) and o]
+
+
+def _field_label(field: dict) -> str:
+    labels = field.get("labels") or {}
+    return labels.get("directLabel") or labels.get("contextText") or ""
+
+
+def _profile_scalar(personal_details: dict, path: str):
+    value = resolve_path(personal_details, path) if path else None
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool) and not is_placeholder(value):
+        return value
+    return None
+
+
+def _rule_for(action: dict, field: dict, personal_details: dict):
+    """
+    Derive a value-free rule from an action, or None if it is not a plain mapping.
+
+    A rule is only kept when replaying it on the same profile reproduces the
+    model's answer exactly - anything involving reformatting stays with the LLM.
+    """
+    path = action.get("source")
+    value = _profile_scalar(personal_details, path)
+    if value is None:
+        return None
+
+    kind = action.get("action")
+    if kind == "fill" and str(action.get("value")) == str(value):
+        return {"action": "fill", "path": path}
+    if kind in ("select", "radio_select") and _field_options(field):
+        if match_option(value, _field_options(field)) == action.get("value"):
+            return {"action": kind, "path": path}
+    if kind == "check" and not _field_options(field):
+        if normalize_text(str(value)) == normalize_text(_field_label(field)):
+            return {"action": kind, "path": path, "when": "equals_label"}
+    return None
+
+
+def _apply_rule(rule: dict, field: dict, personal_details: dict):
+    """Materialize one rule for a field from this user's own profile"""
+    value = _profile_scalar(personal_details, rule["path"])
+    if value is None:
+        return None
+    if rule.get("when") == "equals_label":
+        if normalize_text(str(value)) != normalize_text(_field_label(field)):
+            return None
+        action = {"action": "check"}
+    elif rule["action"] == "fill":
+        action = {"action": "fill", "value": str(value)}
+    else:
+        option_value = match_option(value, _field_options(field))
+        if option_value is None:
+            return None
+        action = {"action": rule["action"], "value": option_value}
+
+    return {
+        "selector": field.get("selector", ""),
+        **action,
+        "confidence": TEMPLATE_CONFIDENCE,
+        "reasoning": f"Form template: '{_field_label(field)}' from {rule['path']}",
+        "source": rule["path"],
+    }
+
+
+class FormTemplates:
+    """
+    Per-form selector -> profile path rules, keyed by structure fingerprint.
+
+    Templates only hold paths and action kinds learned from earlier LLM
+    answers, never values, so they are safe to reuse across users. A rule
+    is only applied once min_profiles different profiles led to it, so one
+    crafted profile or injected prompt cannot map a field for everyone.
+    """
+
+    def __init__(self, max_forms: int = TEMPLATE_CACHE_SIZE, min_profiles: int = TEMPLATE_MIN_PROFILES):
+        self.max_forms = max_forms
+        self.min_profiles = max(min_profiles, 1)
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fields_materialized = 0
+
+    def learn(self, fingerprint: str, fields: list, actions: list, personal_details: dict, profile_key: str):
+        """Record value-free rules from confident LLM actions, observed for the profile profile_key"""
+        if self.max_forms <= 0:
+            return
+        by_selector = {f.get("selector"): f for f in fields}
+        rules = {}
+        for action in actions:
+            field = by_selector.get(action.get("selector"))
+            try:
+                confidence = float(action.get("confidence", 0))
+            except (TypeError, ValueError):
+                confidence = 0.0
+            if field is None or confidence < TEMPLATE_MIN_CONFIDENCE:
+                continue
+            rule = _rule_for(action, field, personal_details)
+            if rule:
+                rules[field["selector"]] = rule
+        if not rules:
+            return
+        with self._lock:
+            template = self._templates.setdefault(fingerprint, {})
+            for selector, rule in rules.items():
+                observed = template.get(selector)
+                if observed is None or observed["rule"] != rule:
+                    # A different answer starts over, the rule needs fresh agreement
+                    observed = template[selector] = {"rule": rule, "profiles": set()}
+                if len(observed["profiles"]) < self.min_profiles:
+                    observed["profiles"].add(profile_key)
+            self._templates.move_to_end(fingerprint)
+            while len(self._templates) > self.max_forms:
+                self._templates.popitem(last=False)
+
+    def materialize(self, fingerprint: str, fields: list, personal_details: dict) -> tuple:
+        """
+        Build actions for fields covered by the form's template.
+
+        Returns (actions, remaining_fields). A covered field whose rule gives
+        no action for this user (e.g. an unchecked gender option) is resolved
+        without an action; fields without a rule remain for the LLM.
+        """
+        with self._lock:
+            template = {selector: observed["rule"]
+                        for selector, observed in (self._templates.get(fingerprint) or {}).items()
+                        if len(observed["profiles"]) >= self.min_profiles}
+            if template:
+                self._templates.move_to_end(fingerprint)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not template:
+            return [], fields
+
+        actions = []
+        remaining = []
+        for field in fields:
+            rule = template.get(field.get("selector"))
+            if rule is None or not needs_filling(field):
+                remaining.append(field)
+                continue
+            if _profile_scalar(personal_details, rule["path"]) is None:
+                remaining.append(field)
+                continue
+            action = _apply_rule(rule, field, personal_details)
+            if action:
+                actions.append(action)
+            elif rule.get("when") != "equals_label":
+                # e.g. this user's country is not among the options - let the LLM decide
+                remaining.append(field)
+        with self._lock:
+            self.fields_materialized += len(actions)
+        return actions, remaining
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "forms": len(self._templates),
+                "rules": sum(1 for t in self._templates.values() for o in t.values()
+                             if len(o["profiles"]) >= self.min_profiles),
+                "pending_rules": sum(1 for t in self._templates.values() for o in t.values()
+                                     if len(o["profiles"]) < self.min_profiles),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fields_materialized": self.fields_materialized,
+            }
+
+
+form_templates = FormTemplates()
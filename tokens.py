@@ -0,0 +1,57 @@
+import re
+import math
+
+# Words, numbers and single punctuation marks - close to how SentencePiece splits JSON
+_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+# Long words and numbers are split into sub-word pieces of roughly this many characters
+CHARS_PER_PIECE = 5
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate for a prompt string, no provider round trip"""
+    if not text:
+        return 0
+    total = 0
+    for piece in _PIECES.findall(text):
+        total += max(1, -(-len(piece) // CHARS_PER_PIECE))
+    return total
+
+
+class TokenCalibration:
+    """
+    Running correction factor from estimate_tokens to the provider's count.
+
+    Every generation reports its real prompt token count; the ratio to the
+    local estimate is smoothed so calibrated counts track the tokenizer
+    without a count_tokens round trip per request.
+    """
+
+    def __init__(self, smoothing: float = 0.1):
+        self.smoothing = smoothing
+        self.ratio = 1.0
+        self.samples = 0
+
+    def observe(self, estimated: int, actual: int):
+        if estimated <= 0 or actual <= 0:
+            return
+        ratio = actual / estimated
+        if self.samples == 0:
+            self.ratio = ratio
+        else:
+            self.ratio = (1 - self.smoothing) * self.ratio + self.smoothing * ratio
+        self.samples += 1
+
+    def count(self, text: str) -> int:
+        return math.ceil(estimate_tokens(text) * self.ratio)
+
+    def stats(self) -> dict:
+        return {"ratio": round(self.ratio, 4), "samples": self.samples}
+
+
+token_calibration = TokenCalibration()
+
+
+def calibrated_tokens(text: str) -> int:
+    """estimate_tokens corrected by the observed provider/estimate ratio"""
+    return token_calibration.count(text)
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Append every finished trace to this file as OTLP/JSON lines ("" disables)
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', '')
+SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'form-autofill-api')
+
+# W3C trace context header: version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_trace = ContextVar("trace", default=None)
+_parent_span = ContextVar("parent_span", default=None)
+_log_lock = threading.Lock()
+
+
+class Trace:
+    """
+    Spans of one request.
+
+    The trace id comes from an incoming traceparent header or is generated.
+    Spans are dicts appended as they end; tasks spawned during the request
+    share the same Trace through the context.
+    """
+
+    def __init__(self, traceparent: str = None):
+        match = _TRACEPARENT.match((traceparent or "").strip().lower())
+        self.trace_id = match.group(1) if match else os.urandom(16).hex()
+        self.remote_parent = match.group(2) if match else None
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.spans = []
+        # Set by handlers whose work outlives the response headers (streams), they export themselves
+        self.deferred = False
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: span durations summed per name, plus total"""
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0) + span["end"] - span["start"]
+        totals["total"] = time.time_ns() - self.start_ns
+        return ", ".join(f"{name};dur={ns / 1e6:.1f}" for name, ns in totals.items())
+
+
+def start_trace(traceparent: str = None) -> Trace:
+    """Begin a trace for the current request and make it the context's trace"""
+    trace = Trace(traceparent)
+    _trace.set(trace)
+    _parent_span.set(trace.span_id)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def start_span(name: str, **attributes):
+    """Open a child of the current span; None when no trace is active"""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    span = {
+        "name": name,
+        "span_id": os.urandom(8).hex(),
+        "parent": _parent_span.get(),
+        "start": time.time_ns(),
+        "end": None,
+        "attributes": attributes,
+    }
+    span["token"] = _parent_span.set(span["span_id"])
+    return span
+
+
+def end_span(span, **attributes):
+    if span is None or span["end"] is not None:
+        return
+    span["end"] = time.time_ns()
+    span["attributes"].update(attributes)
+    try:
+        _parent_span.reset(span.pop("token"))
+    except ValueError:
+        # Ended from another context (e.g. a different task), nothing to restore here
+        pass
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append(span)
+
+
+def add_span(name: str, start_ns: int, end_ns: int = None, **attributes):
+    """Record an already finished span (e.g. work done before the handler ran)"""
+    trace = _trace.get()
+    if trace is None:
+        return
+    trace.spans.append({
+        "name": name,
+        "span_id": os.urandom(8).hex(),
+        "parent": _parent_span.get(),
+        "start": start_ns,
+        "end": end_ns or time.time_ns(),
+        "attributes": attributes,
+    })
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the block as a child span of the current one"""
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except Exception as e:
+        if current is not None:
+            current["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        end_span(current)
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(trace: Trace, span: dict) -> dict:
+    otlp = {
+        "traceId": trace.trace_id,
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": span.get("kind", 1),
+        "startTimeUnixNano": str(span["start"]),
+        "endTimeUnixNano": str(span["end"]),
+        "attributes": [_attribute(k, v) for k, v in span["attributes"].items()],
+    }
+    if span["parent"]:
+        otlp["parentSpanId"] = span["parent"]
+    if span.get("error"):
+        otlp["status"] = {"code": 2, "message": span["error"]}
+    return otlp
+
+
+def export(trace: Trace, name: str, **attributes):
+    """
+    Close the request's root span and append the trace to TRACE_LOG_PATH.
+
+    Each line is an OTLP/JSON ExportTraceServiceRequest, readable by the
+    OpenTelemetry collector's file receiver and most trace viewers.
+    """
+    if not TRACE_LOG_PATH:
+        return
+    root = {"name": name, "span_id": trace.span_id, "parent": trace.remote_parent,
+            "start": trace.start_ns, "end": time.time_ns(), "attributes": attributes, "kind": 2}
+    request = {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{
+            "scope": {"name": "autofill"},
+            "spans": [_otlp_span(trace, s) for s in [root] + trace.spans],
+        }],
+    }]}
+    line = json.dumps(request, separators=(",", ":"))
+    try:
+        with _log_lock, open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"⚠️  Could not write trace log: {e}")
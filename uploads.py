@@ -0,0 +1,135 @@
+import re
+from matcher import normalize_text, resolve_path, is_placeholder, needs_filling
+
+# Strings this long that only use the base64 alphabet are treated as file contents
+BASE64_MIN_LENGTH = 256
+# Wrapped base64 (MIME, PEM) breaks lines every 64-76 characters, never spaces
+BASE64_MIN_LINE = 60
+_BASE64 = re.compile(r"^[A-Za-z0-9+/=\r\n]+$")
+_DATA_URL = re.compile(r"^data:([\w.+-]+/[\w.+-]+)?(;[\w=-]+)*;base64,", re.IGNORECASE)
+
+BLOB_KEY_HINTS = ("base64", "blob", "filedata", "file_data", "dataurl", "data_url")
+
+# Upload kinds the server can complete on its own: label synonyms, where the
+# filename lives, and where the file contents live in personal_details
+FILE_KINDS = {
+    "resume": {
+        "labels": ["resume", "cv", "curriculum vitae"],
+        "filename_paths": ["resume_filename", "resumeFilename"],
+        "blob_paths": ["resume_base64", "resumeBase64"],
+    },
+    "cover_letter": {
+        "labels": ["cover letter", "covering letter", "motivation letter"],
+        "filename_paths": ["cover_letter_filename", "coverLetterFilename"],
+        "blob_paths": ["cover_letter_base64", "coverLetterBase64"],
+    },
+}
+
+
+def _is_blob(key: str, value) -> bool:
+    if not isinstance(value, str):
+        return False
+    if _DATA_URL.match(value):
+        return True
+    lowered = key.lower()
+    if any(hint in lowered for hint in BLOB_KEY_HINTS) and len(value) > 64:
+        return True
+    if len(value) < BASE64_MIN_LENGTH:
+        return False
+    head = value[:4096]
+    # A newline-separated list of words is text, wrapped base64 has long lines
+    return bool(_BASE64.match(head)) and head.count("\n") <= len(head) // BASE64_MIN_LINE
+
+
+def _describe(value: str) -> str:
+    size = len(value) * 3 // 4
+    if size >= 1024 * 1024:
+        readable = f"{size / (1024 * 1024):.1f} MB"
+    else:
+        readable = f"{max(size // 1024, 1)} KB"
+    return f"<file attached, {readable}, handled by server>"
+
+
+def strip_blobs(personal_details: dict) -> tuple:
+    """
+    Replace binary payloads (base64 strings, data URLs) with a short descriptor.
+
+    Returns (clean_details, blob_paths) - blob_paths lists the dotted paths that
+    were replaced so uploads can still be resolved server-side.
+    """
+    blob_paths = []
+
+    def clean(node, path):
+        if isinstance(node, dict):
+            result = {}
+            for key, value in node.items():
+                child = f"{path}.{key}" if path else key
+                if _is_blob(key, value):
+                    blob_paths.append(child)
+                    result[key] = _describe(value)
+                else:
+                    result[key] = clean(value, child)
+            return result
+        if isinstance(node, list):
+            return [clean(item, f"{path}.{i}") for i, item in enumerate(node)]
+        return node
+
+    return clean(personal_details, ""), blob_paths
+
+
+def _first_value(personal_details: dict, paths: list):
+    for path in paths:
+        value = resolve_path(personal_details, path)
+        if not is_placeholder(value):
+            return value
+    return None
+
+
+def _file_kind(field: dict):
+    labels = field.get("labels") or {}
+    text = " ".join(normalize_text(t) for t in [
+        labels.get("directLabel"), labels.get("contextText"), labels.get("groupLabel"),
+        field.get("name"), field.get("id"),
+    ])
+    text = f" {text} "
+    for kind, entry in FILE_KINDS.items():
+        if any(f" {label} " in text for label in entry["labels"]):
+            return kind
+    return None
+
+
+def resolve_uploads(fields: list, personal_details: dict) -> tuple:
+    """
+    Complete file fields server-side from the stored filenames.
+
+    File inputs never go to the LLM: a field gets an upload_file action when
+    its kind is recognized and both the filename and file contents exist.
+    Returns (actions, remaining_fields).
+    """
+    actions = []
+    remaining = []
+    for field in fields:
+        if (field.get("type") or "").lower() != "file":
+            remaining.append(field)
+            continue
+        if not needs_filling(field):
+            continue
+        kind = _file_kind(field)
+        if kind is None:
+            continue
+        entry = FILE_KINDS[kind]
+        filename_path = next((p for p in entry["filename_paths"]
+                              if not is_placeholder(resolve_path(personal_details, p))), None)
+        filename = resolve_path(personal_details, filename_path) if filename_path else None
+        blob = _first_value(personal_details, entry["blob_paths"])
+        if filename and blob:
+            labels = field.get("labels") or {}
+            actions.append({
+                "selector": field.get("selector", ""),
+                "action": "upload_file",
+                "value": filename,
+                "confidence": 0.95,
+                "reasoning": f"Attached {kind.replace('_', ' ')} to '{labels.get('directLabel', '')}' (server-side)",
+                "source": filename_path,
+            })
+    return actions, remaining